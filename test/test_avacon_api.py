@@ -0,0 +1,292 @@
+"""Module to test avacon_api.py functions"""
+# stdlib
+import json
+import operator
+import time
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# third party
+import pytest
+import pandas as pd
+
+# relative
+from tmh_server import avacon_api
+from tmh_server.avacon_api import AvaconAPI, RateLimit
+from tmh_server.avacon_cache import AvaconCache
+
+CONFIG: dict = {"networkoperator": "ava", "type": "finished", "chunkNr": 1,
+                "param1": "start", "op1": "gOE", "startOp": "ge", "val1": "2022-01-15",
+                "param2": "end", "op2": "lOE", "endOp": "le", "val2": "2022-03-31"}
+OPERATORS: dict = {"gOE": operator.ge, "gt": operator.gt, "lOE": operator.le,
+                   "lt": operator.lt, "equals": operator.eq}
+CSV: bytes = ('"ID";"Start";"Ende"\n'
+              '1;2022-01-20 10:00:00;2022-01-20 11:00:00\n'
+              '2;2022-02-10 10:00:00;2022-02-10 11:00:00\n').encode("utf-8")
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serves CSV exports and answers with the queued status codes first.
+    """
+    protocol_version: str = "HTTP/1.1"
+    statuses: list = []
+    clients: list = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Answer a GET request of AvaconAPI.
+        """
+        StubHandler.clients.append(self.client_address)
+        status: int = StubHandler.statuses.pop(0) if StubHandler.statuses else 200
+        body: bytes = CSV if status == 200 else b""
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class PagingHandler(BaseHTTPRequestHandler):
+    """
+    Filters the rows on the query like the API does and answers with at
+    most avacon_api.PAGE_SIZE rows sorted by Start.
+    """
+    protocol_version: str = "HTTP/1.1"
+    rows: pd.DataFrame = pd.DataFrame()
+    queries: list = []
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Answer a GET request of AvaconAPI.
+        """
+        query: dict = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        PagingHandler.queries.append(query)
+        lower: pd.Timestamp = pd.Timestamp(query["val1"])
+        upper: pd.Timestamp = pd.Timestamp(query["val2"])
+        if len(query["val2"]) == 10:
+            upper += pd.Timedelta(hours=23, minutes=59, seconds=59)
+        rows: pd.DataFrame = PagingHandler.rows
+        column: str = "Start" if query["param2"] == "start" else "Ende"
+        rows = rows[OPERATORS[query["op1"]](pd.to_datetime(rows["Start"]), lower) &
+                    OPERATORS[query["op2"]](pd.to_datetime(rows[column]), upper)]
+        rows = rows.sort_values(by=["Start"], kind="stable").head(avacon_api.PAGE_SIZE)
+        body: bytes = rows.to_csv(sep=";", index=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def run_stub_server(handler=StubHandler) -> ThreadingHTTPServer:
+    server: ThreadingHTTPServer = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def write_config(path,
+                 **overrides) -> None:
+    with open(path / "avacon_api.json", "w", encoding="utf-8") as f:
+        json.dump(dict(CONFIG, **overrides), f)
+
+
+def test_split_window():
+    api: AvaconAPI = AvaconAPI(config_path="", config_name="")
+    api.config = dict(CONFIG)
+    windows: list = api._split_window("MS")
+    assert windows == [("2022-01-15 00:00:00", "2022-01-31 23:59:59"),
+                       ("2022-02-01 00:00:00", "2022-02-28 23:59:59"),
+                       ("2022-03-01 00:00:00", "2022-03-31 23:59:59")]
+
+
+def test_merge_windows():
+    api: AvaconAPI = AvaconAPI(config_path="", config_name="")
+    api.config = dict(CONFIG)
+    frames: list = [pd.DataFrame({"ID": [2, 1],
+                                  "Start": pd.to_datetime(["2022-01-31 23:00:00", "2022-01-20 10:00:00"]),
+                                  "Ende": ["2022-02-01 01:00:00", "2022-01-20 11:00:00"]}),
+                    pd.DataFrame(),
+                    pd.DataFrame({"ID": [2, 3],
+                                  "Start": pd.to_datetime(["2022-01-31 23:00:00", "2022-03-31 23:00:00"]),
+                                  "Ende": ["2022-02-01 01:00:00", "2022-04-01 01:00:00"]})]
+    df: pd.DataFrame = api._merge_windows(frames)
+    assert df["ID"].tolist() == [1, 2]
+
+
+def test_call_api_parallel_uses_inclusive_ranges(tmp_path):
+    # Operators of the example request in the README
+    write_config(tmp_path, op1="gt", startOp="gt", op2="equals", endOp="eq")
+    starts: list = ["2022-01-15 00:00:00", "2022-01-20 10:00:00", "2022-02-01 00:00:00",
+                    "2022-02-10 10:00:00", "2022-03-31 23:59:59"]
+    PagingHandler.rows = pd.DataFrame({"ID": range(1, len(starts) + 1),
+                                       "Start": starts,
+                                       "Ende": starts})
+    PagingHandler.queries = []
+    server: ThreadingHTTPServer = run_stub_server(PagingHandler)
+    api: AvaconAPI = AvaconAPI(config_path=str(tmp_path),
+                               config_name="avacon_api.json",
+                               base_url=f"http://127.0.0.1:{server.server_port}/api/export")
+    df: pd.DataFrame = api.call_api_parallel(max_workers=2)
+    api.close()
+    server.shutdown()
+    assert df["ID"].tolist() == list(range(1, len(starts) + 1))
+    assert {(q["op1"], q["op2"]) for q in PagingHandler.queries} == {("gOE", "lOE")}
+
+
+def test_call_api_retries_on_one_connection(tmp_path):
+    write_config(tmp_path)
+    server: ThreadingHTTPServer = run_stub_server()
+    StubHandler.statuses = [503, 429]
+    StubHandler.clients = []
+    api: AvaconAPI = AvaconAPI(config_path=str(tmp_path),
+                               config_name="avacon_api.json",
+                               base_url=f"http://127.0.0.1:{server.server_port}/api/export",
+                               backoff_factor=0.01)
+    df: pd.DataFrame = api.call_api()
+    api.close()
+    server.shutdown()
+    assert df["ID"].tolist() == [1, 2]
+    assert len(StubHandler.clients) == 3
+    assert len(set(StubHandler.clients)) == 1
+
+
+def test_call_api_gives_up(tmp_path):
+    write_config(tmp_path)
+    server: ThreadingHTTPServer = run_stub_server()
+    StubHandler.statuses = [500, 500, 500]
+    api: AvaconAPI = AvaconAPI(config_path=str(tmp_path),
+                               config_name="avacon_api.json",
+                               base_url=f"http://127.0.0.1:{server.server_port}/api/export",
+                               max_retries=2,
+                               backoff_factor=0.01)
+    with pytest.raises(Exception, match="500"):
+        api.call_api()
+    api.close()
+    server.shutdown()
+
+
+def test_iter_batches(tmp_path):
+    write_config(tmp_path)
+    server: ThreadingHTTPServer = run_stub_server()
+    StubHandler.statuses = [503]
+    api: AvaconAPI = AvaconAPI(config_path=str(tmp_path),
+                               config_name="avacon_api.json",
+                               base_url=f"http://127.0.0.1:{server.server_port}/api/export",
+                               backoff_factor=0.01)
+    batches: list = list(api.iter_batches(chunksize=1))
+    api.close()
+    server.shutdown()
+    assert len(batches) == 2
+    assert [b["ID"].iloc[0] for b in batches] == [1, 2]
+    assert pd.api.types.is_datetime64_any_dtype(batches[0]["Start"])
+
+
+def test_pages_are_concatenated_once():
+    api: AvaconAPI = AvaconAPI(config_path="", config_name="")
+    for page in [pd.DataFrame({'"ID"': [3, 1], '"Start"': ["2022-01-03 10:00:00", "2022-01-01 10:00:00"]}),
+                 pd.DataFrame({'"ID"': [1, 2], '"Start"': ["2022-01-01 10:00:00", "2022-01-02 10:00:00"]})]:
+        api.pages.append(api._prepare_page(page))
+    df: pd.DataFrame = api._concat_pages()
+    assert df["ID"].tolist() == [1, 2, 3]
+    assert api.page_last_start == pd.Timestamp("2022-01-03 10:00:00")
+
+
+def test_cache_serves_closed_months(tmp_path):
+    write_config(tmp_path)
+    server: ThreadingHTTPServer = run_stub_server()
+    StubHandler.clients = []
+    api: AvaconAPI = AvaconAPI(config_path=str(tmp_path),
+                               config_name="avacon_api.json",
+                               base_url=f"http://127.0.0.1:{server.server_port}/api/export",
+                               cache=AvaconCache(str(tmp_path / "cache")))
+    first: pd.DataFrame = api.call_api()
+    requests_first_run: int = len(StubHandler.clients)
+    second: pd.DataFrame = api.call_api()
+    api.close()
+    server.shutdown()
+    assert requests_first_run == 3
+    assert len(StubHandler.clients) == 3
+    assert first.equals(second)
+
+
+def test_cursor_paging(tmp_path, monkeypatch):
+    write_config(tmp_path)
+    monkeypatch.setattr(avacon_api, "PAGE_SIZE", 3)
+    starts: list = ["2022-01-20 10:00:00", "2022-01-20 10:00:00", "2022-01-20 10:30:00",
+                    "2022-01-20 10:30:00", "2022-01-20 10:45:00", "2022-01-20 11:00:00",
+                    "2022-02-01 08:00:00", "2022-02-01 08:00:00", "2022-03-31 22:00:00"]
+    PagingHandler.rows = pd.DataFrame({"ID": range(1, len(starts) + 1),
+                                       "Start": starts,
+                                       "Ende": (pd.to_datetime(starts) + pd.Timedelta(hours=1))
+                                       .strftime("%Y-%m-%d %H:%M:%S")})
+    PagingHandler.queries = []
+    server: ThreadingHTTPServer = run_stub_server(PagingHandler)
+    api: AvaconAPI = AvaconAPI(config_path=str(tmp_path),
+                               config_name="avacon_api.json",
+                               base_url=f"http://127.0.0.1:{server.server_port}/api/export")
+    df: pd.DataFrame = api.call_api()
+    api.close()
+    server.shutdown()
+    assert df["ID"].tolist() == list(range(1, len(starts) + 1))
+    assert PagingHandler.queries[1]["val1"] == "2022-01-20 10:30:00"
+    assert len(PagingHandler.queries) < 20
+
+
+def test_cursor_paging_uses_inclusive_windows(tmp_path, monkeypatch):
+    # Operators of the example request in the README
+    write_config(tmp_path, op1="gt", startOp="gt", op2="equals", endOp="eq")
+    monkeypatch.setattr(avacon_api, "PAGE_SIZE", 3)
+    starts: list = ["2022-01-20 10:00:00", "2022-01-20 10:30:00", "2022-01-20 11:00:00",
+                    "2022-01-20 11:00:00", "2022-01-25 10:00:00", "2022-02-10 10:00:00"]
+    PagingHandler.rows = pd.DataFrame({"ID": range(1, len(starts) + 1),
+                                       "Start": starts,
+                                       "Ende": "2022-03-31 23:59:59"})
+    PagingHandler.queries = []
+    server: ThreadingHTTPServer = run_stub_server(PagingHandler)
+    api: AvaconAPI = AvaconAPI(config_path=str(tmp_path),
+                               config_name="avacon_api.json",
+                               base_url=f"http://127.0.0.1:{server.server_port}/api/export")
+    df: pd.DataFrame = api.call_api()
+    api.close()
+    server.shutdown()
+    assert df["ID"].tolist() == list(range(1, len(starts) + 1))
+    assert {(q["op1"], q["op2"]) for q in PagingHandler.queries[1:]} == {("gOE", "lOE")}
+
+
+def test_cursor_paging_without_progress(tmp_path, monkeypatch):
+    write_config(tmp_path)
+    monkeypatch.setattr(avacon_api, "PAGE_SIZE", 3)
+    PagingHandler.rows = pd.DataFrame({"ID": [1, 2, 3, 4],
+                                       "Start": ["2022-01-20 10:00:00"] * 4,
+                                       "Ende": ["2022-01-20 11:00:00"] * 4})
+    server: ThreadingHTTPServer = run_stub_server(PagingHandler)
+    api: AvaconAPI = AvaconAPI(config_path=str(tmp_path),
+                               config_name="avacon_api.json",
+                               base_url=f"http://127.0.0.1:{server.server_port}/api/export")
+    with pytest.raises(Exception, match="More than 3 curtailments start at"):
+        api.call_api()
+    api.close()
+    server.shutdown()
+
+
+def test_rate_limit_is_shared_by_threads():
+    rate_limit: RateLimit = RateLimit(0.05)
+    start: float = time.monotonic()
+    threads: list = [threading.Thread(target=rate_limit.wait) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.monotonic() - start >= 0.15
+
+
+def test_get_window(tmp_path):
+    write_config(tmp_path)
+    api: AvaconAPI = AvaconAPI(config_path=str(tmp_path), config_name="avacon_api.json")
+    assert api.get_window() == (pd.Timestamp("2022-01-15"), pd.Timestamp("2022-03-31 23:59:59"))
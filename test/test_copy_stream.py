@@ -0,0 +1,36 @@
+"""Module to test copy_stream.py functions"""
+# stdlib
+import struct
+
+# third party
+import pandas as pd
+
+# relative
+from tmh_server import copy_stream as cs
+
+DF: pd.DataFrame = pd.DataFrame(data={"start_curtailment": pd.to_datetime(["2000-01-01 00:00:01", None]),
+                                      "level": [30, 60],
+                                      "cause": ["Netz; Engpass", None],
+                                      "power_nominal": [123.45, 0.001]})
+
+
+def test_csv_chunks():
+    data: bytes = cs.CopyStream(cs.csv_chunks(DF, ["cause", "level"], chunksize=1)).read()
+    assert data == b'Netz; Engpass,30\n,60\n'
+
+
+def test_binary_chunks():
+    data: bytes = cs.CopyStream(cs.binary_chunks(DF, ["start_curtailment", "level", "cause"],
+                                                 [1114, 21, 1043], chunksize=1)).read()
+    assert data.startswith(cs.BINARY_HEADER)
+    assert data.endswith(cs.BINARY_TRAILER)
+    first_row: bytes = data[len(cs.BINARY_HEADER):]
+    assert struct.unpack(">hiqih", first_row[:20]) == (3, 8, 1000000, 2, 30)
+    assert first_row[20:37] == struct.pack(">i", 13) + b"Netz; Engpass"
+
+
+def test_encode_numeric():
+    assert cs.encode_numeric(123.45) == struct.pack(">ihhhhhh", 12, 2, 0, 0, 2, 123, 4500)
+    assert cs.encode_numeric(0.001) == struct.pack(">ihhhhh", 10, 1, -1, 0, 3, 10)
+    assert cs.encode_numeric(-5) == struct.pack(">ihhhhh", 10, 1, 0, 0x4000, 0, 5)
+    assert cs.encode_numeric(None) == cs.NULL
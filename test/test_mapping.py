@@ -0,0 +1,61 @@
+"""Module to test mapping.py functions"""
+
+# third party
+import pytest
+import pandas as pd
+
+# relative
+from tmh_server.mapping import Mapping
+
+DF_MASTR: pd.DataFrame = pd.DataFrame(data={"EEG-Anlagenschlüssel": ["E123", "E456", None, "E789"],
+                                            "Nettonennleistung der Einheit": ["9,9", "1000", "5,5", None]})
+
+
+def test_get_plant_power():
+    mapper: Mapping = Mapping("", "")
+    mapper.df_mastr = DF_MASTR.copy()
+    df: pd.DataFrame = mapper.get_plant_power()
+    assert df["plant_id"].tolist() == ["E123", "E456"]
+    assert df["power_nominal"].tolist() == pytest.approx([9.9, 1000.0])
+    assert df["power_nominal"].dtype == "float32"
+
+
+def test_map_batches():
+    mapper: Mapping = Mapping("", "")
+    mapper.df_mastr = DF_MASTR.copy()
+    mapper.create_mapping()
+    batches: list = [pd.DataFrame({"plant_id": ["E123", "E999"], "level": [30, 0], "duration": [60, 60]}),
+                     pd.DataFrame({"plant_id": ["E456"], "level": [60], "duration": [30]})]
+    mapped: list = list(mapper.map_batches(batches))
+    assert [df["plant_id"].tolist() for df in mapped] == [["E123"], ["E456"]]
+    assert mapped[0]["energy_curtailed"].tolist() == pytest.approx([6.93])
+    assert mapped[1]["energy_curtailed"].tolist() == pytest.approx([200.0])
+
+
+def test_load_plant_index(tmp_path):
+    DF_MASTR.to_csv(tmp_path / "mastr_2022_simplified.csv", sep=";", index=False)
+    mapper: Mapping = Mapping(str(tmp_path), "")
+    plant_index: pd.Series = mapper.load_plant_index(snapshot="2022-12-31")
+    assert (tmp_path / "plant_index_2022-12-31.parquet").is_file()
+    assert plant_index.index.tolist() == ["E123", "E456"]
+
+    DF_MASTR.iloc[:1].to_csv(tmp_path / "mastr_2022_simplified.csv", sep=";", index=False)
+    plant_index = mapper.load_plant_index(snapshot="2022-12-31")
+    assert plant_index.index.tolist() == ["E123"]
+
+    mapper.set_df(pd.DataFrame({"plant_id": ["E123", "E456"], "power_nominal": [0, 0]}))
+    mapper.map_power_to_plant_id()
+    assert mapper.df_db["power_nominal"].tolist() == pytest.approx([9.9])
+
+
+def test_map_power_to_plant_id_reports_unmatched():
+    mapper: Mapping = Mapping("", "")
+    mapper.df_mastr = DF_MASTR.copy()
+    mapper.create_mapping()
+    mapper.set_df(pd.DataFrame({"plant_id": ["E456", "E999", "E123", "E456", None, "E999"],
+                                "power_nominal": [0, 0, 0, 0, 0, 0]}))
+    mapper.map_power_to_plant_id()
+    assert mapper.df_db["plant_id"].tolist() == ["E456", "E123", "E456"]
+    assert mapper.df_db["power_nominal"].tolist() == pytest.approx([1000.0, 9.9, 1000.0])
+    assert mapper.get_unmatched_plant_ids().to_dict() == {"E999": 2}
+    assert mapper.df_unmatched.shape[0] == 3
@@ -0,0 +1,175 @@
+"""Module to test mastr_scrapper.py functions"""
+# stdlib
+import os
+import time
+import shutil
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+# third party
+import pytest
+import pandas as pd
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+
+# relative
+from tmh_server import read_file as rf
+from tmh_server.mastr_scrapper import MastrScrapper, MastrScrapeScheduler
+
+TEST_DIR: str = "test"
+TEST_FILE_HTML: str = "test_mastr.html"
+
+SNB: pd.DataFrame = pd.DataFrame(data={"EEG-Anlagenschlüssel": ["E123", "E456"],
+                                       "Nettonennleistung der Einheit": ["9,9", "1000"],
+                                       "Inbetriebnahmedatum der Einheit": ["01/12/2022", "01/02/2023"],
+                                       "Postleitzahl": ["12345", "67890"]})
+
+
+def test_merge_snbs_into_one_csv(tmp_path):
+    os.makedirs(tmp_path / "SNBs")
+    SNB.to_csv(tmp_path / "SNBs" / "SNB1.csv", sep=";", index=False)
+    SNB.assign(**{"EEG-Anlagenschlüssel": ["E789", "E135"]}).to_csv(tmp_path / "SNBs" / "SNB2.csv",
+                                                                  sep=";", index=False)
+    scrapper: MastrScrapper = MastrScrapper()
+    scrapper.merge_snbs_into_one_csv(str(tmp_path), max_workers=2)
+    df: pd.DataFrame = pd.read_csv(tmp_path / "mastr_2022.csv", sep=";", index_col=0)
+    assert df["EEG-Anlagenschlüssel"].tolist() == ["E123", "E789"]
+    assert df["Nettonennleistung der Einheit"].tolist() == ["9,9", "9,9"]
+    assert "Postleitzahl" not in df.columns
+
+    modified: float = os.path.getmtime(tmp_path / "mastr_2022.csv")
+    scrapper.merge_snbs_into_one_csv(str(tmp_path), max_workers=2)
+    assert os.path.getmtime(tmp_path / "mastr_2022.csv") == modified
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the Marktstammdatenregister fixture for every path and the
+    CSV download for /Stromerzeuger.csv.
+    """
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Answer a GET request of the browser.
+        """
+        if self.path.startswith("/Stromerzeuger.csv"):
+            body: bytes = SNB.to_csv(sep=";", index=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Content-Disposition", 'attachment; filename="Stromerzeuger.csv"')
+        else:
+            with open(os.path.join(os.getcwd(), TEST_DIR, TEST_FILE_HTML), "rb") as f:
+                body: bytes = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def fake_download(self):
+    if self.nb_mastr_nr == "SNB_FAIL":
+        raise ValueError("page changed")
+    os.makedirs(self.path_download, exist_ok=True)
+    SNB.to_csv(os.path.join(self.path_download, "Stromerzeuger.csv"), sep=";", index=False)
+    return True
+
+
+class FakeElement:
+    """
+    Visible element of a page, which can be clicked.
+    """
+    text: str = ""
+
+    def click(self):
+        pass
+
+    def is_displayed(self):
+        return True
+
+    def is_enabled(self):
+        return True
+
+
+class FakeDriver:
+    """
+    Browser which opens every page but only shows the elements with the
+    given CSS selectors.
+    """
+    def __init__(self, selectors: tuple=()):
+        self.selectors: tuple = selectors
+
+    def get(self, url):
+        pass
+
+    def find_element(self, by, value):
+        if value not in self.selectors:
+            raise NoSuchElementException(value)
+        return FakeElement()
+
+    def find_elements(self, by, value):
+        return [FakeElement()] if value in self.selectors else []
+
+    def quit(self):
+        pass
+
+
+def test_scheduler_resumes_from_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(MastrScrapper, "download_via_link", fake_download)
+    scheduler: MastrScrapeScheduler = MastrScrapeScheduler(str(tmp_path), n_workers=2)
+    failed: dict = scheduler.run(["SNB1", "SNB2", "SNB_FAIL"])
+    assert list(failed.keys()) == ["SNB_FAIL"]
+    assert sorted(os.listdir(tmp_path / "SNBs")) == ["SNB1.csv", "SNB2.csv"]
+    assert rf.json_to_dict(str(tmp_path), "scrap_checkpoint.json") == {"completed": ["SNB1", "SNB2"]}
+
+    attempted: list = []
+    monkeypatch.setattr(MastrScrapper, "download_via_link",
+                        lambda self: attempted.append(self.nb_mastr_nr))
+    scheduler.run(["SNB1", "SNB2", "SNB_FAIL"])
+    assert attempted == ["SNB_FAIL"]
+
+
+
+def test_scheduler_does_not_complete_timeouts(tmp_path, monkeypatch):
+    def slow_click(self, css_selector):
+        # The download of the timed out network operator arrives later
+        with open(os.path.join(self.path_download, "Stromerzeuger.csv.part"), "w", encoding="utf-8"):
+            pass
+        raise TimeoutException(css_selector)
+
+    monkeypatch.setattr(MastrScrapper, "_create_driver", lambda self: FakeDriver())
+    monkeypatch.setattr(MastrScrapper, "_click", slow_click)
+    os.makedirs(tmp_path / "downloads" / "worker_0")
+    scheduler: MastrScrapeScheduler = MastrScrapeScheduler(str(tmp_path), n_workers=1)
+    failed: dict = scheduler.run(["SNB1"])
+    assert list(failed.keys()) == ["SNB1"]
+    assert not os.listdir(tmp_path / "SNBs")
+    assert not os.listdir(tmp_path / "downloads" / "worker_0")
+    assert not os.path.isfile(tmp_path / "scrap_checkpoint.json")
+
+
+def test_scheduler_completes_operators_without_entries(tmp_path, monkeypatch):
+    page: tuple = ("#grid-stromerzeugung-erweitert .gridReloadBtn",
+                   "#grid-stromerzeugung-erweitert .k-grid-norecords")
+    monkeypatch.setattr(MastrScrapper, "_create_driver", lambda self: FakeDriver(page))
+    scheduler: MastrScrapeScheduler = MastrScrapeScheduler(str(tmp_path), n_workers=1, timeout=5)
+    start: float = time.time()
+    failed: dict = scheduler.run(["SNB1"])
+    assert not failed
+    assert time.time() - start < 5
+    assert not os.listdir(tmp_path / "SNBs")
+    assert rf.json_to_dict(str(tmp_path), "scrap_checkpoint.json") == {"completed": ["SNB1"]}
+
+
+@pytest.mark.skipif(shutil.which("firefox") is None or shutil.which("geckodriver") is None,
+                    reason="Firefox and geckodriver are required")
+def test_scheduler_with_html_fixture(tmp_path):
+    server: ThreadingHTTPServer = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    scheduler: MastrScrapeScheduler = MastrScrapeScheduler(str(tmp_path), n_workers=2, timeout=20,
+                                                           base_url=f"http://127.0.0.1:{server.server_port}")
+    failed: dict = scheduler.run(["SNB1", "SNB2"])
+    server.shutdown()
+    assert not failed
+    assert sorted(os.listdir(tmp_path / "SNBs")) == ["SNB1.csv", "SNB2.csv"]
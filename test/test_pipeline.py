@@ -0,0 +1,200 @@
+"""Module to test pipeline.py functions"""
+# stdlib
+import json
+import time
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# third party
+import pytest
+import pandas as pd
+
+# relative
+from tmh_server import pipeline
+from tmh_server.pipeline import run_overlapped, fetch_operators, sync_incremental
+
+CONFIG: dict = {"networkoperator": "ava", "type": "finished", "chunkNr": 1,
+                "param1": "start", "op1": "gOE", "startOp": "ge", "val1": "2022-01-01",
+                "param2": "end", "op2": "lOE", "endOp": "le", "val2": "2022-01-31"}
+
+
+class OperatorHandler(BaseHTTPRequestHandler):
+    """
+    Serves one curtailment per operator and window, unknown operators
+    are answered with 404.
+    """
+    protocol_version: str = "HTTP/1.1"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Answer a GET request of AvaconAPI.
+        """
+        query: dict = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        status: int = 404 if query["networkoperator"] == "bad" else 200
+        body: bytes = b""
+        if status == 200:
+            body = ('"ID";"Start";"Ende";"Dauer (Min)";"Stufe (%)";"Ursache";'
+                    '"Anlagenschlüssel";"Netzbetreiber"\n'
+                    f'{query["networkoperator"]}-{query["val1"]};{query["val1"]} 10:00:00;'
+                    f'{query["val1"]} 10:05:00;5;30;Netz;E123;{query["networkoperator"]}\n'
+                    ).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+def slow_source(n: int,
+                delay: float,
+                produced: list):
+    for i in range(n):
+        time.sleep(delay)
+        produced.append(i)
+        yield pd.DataFrame({"value": [i]})
+
+
+def slow_stage(batches):
+    for batch in batches:
+        time.sleep(0.05)
+        yield batch.assign(value=batch["value"] * 2)
+
+
+def failing_stage(batches):
+    for batch in batches:
+        if batch["value"].iloc[0] == 2:
+            raise ValueError("broken batch")
+        yield batch
+
+
+def test_run_overlapped():
+    produced: list = []
+    consumed: list = []
+
+    def sink(batches) -> int:
+        for batch in batches:
+            time.sleep(0.05)
+            consumed.extend(batch["value"].tolist())
+        return len(consumed)
+
+    start: float = time.time()
+    rows: int = run_overlapped(slow_source(10, 0.05, produced), [slow_stage], sink)
+    assert rows == 10
+    assert consumed == [2 * i for i in range(10)]
+    # Stages overlap, sequential execution takes 1.5s
+    assert time.time() - start < 1.2
+
+
+def test_run_overlapped_is_bounded():
+    produced: list = []
+    backlog: list = []
+
+    def sink(batches) -> None:
+        for batch in batches:
+            backlog.append(len(produced) - batch["value"].iloc[0] // 2)
+            time.sleep(0.02)
+
+    run_overlapped(slow_source(30, 0, produced), [slow_stage], sink, maxsize=1)
+    # one batch per queue, one per stage, and one in the source
+    assert max(backlog) <= 5
+
+
+def test_run_overlapped_stops_on_error():
+    produced: list = []
+    seen: list = []
+
+    def sink(batches) -> None:
+        for batch in batches:
+            seen.append(batch)
+
+    with pytest.raises(ValueError, match="broken batch"):
+        run_overlapped(slow_source(100, 0, produced), [failing_stage], sink)
+    assert len(seen) == 2
+    assert len(produced) < 100
+
+
+def test_fetch_operators(tmp_path):
+    server: ThreadingHTTPServer = ThreadingHTTPServer(("127.0.0.1", 0), OperatorHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with open(tmp_path / "avacon_api.json", "w", encoding="utf-8") as f:
+        json.dump(dict(CONFIG), f)
+    windows: list = [("2022-01-01", "2022-01-31"), ("2022-02-01", "2022-02-28")]
+    try:
+        df, failed = fetch_operators(str(tmp_path), "avacon_api.json",
+                                     ["ava", "bad", "edis"], windows,
+                                     max_workers=2, min_interval={"ava": 0.01},
+                                     base_url=f"http://127.0.0.1:{server.server_port}/api/export")
+    finally:
+        server.shutdown()
+    assert list(failed) == ["bad"]
+    assert "404" in failed["bad"]
+    assert df["operator"].tolist() == ["ava", "ava", "edis", "edis"]
+    assert df["start_curtailment"].dt.month.tolist() == [1, 2, 1, 2]
+
+
+class FakePostgreSQL:
+    """
+    Database with a fixed high-water mark, remembering upserted rows.
+    """
+    upserted: list = []
+
+    def __init__(self, config_path, config_name, data):
+        self.df: pd.DataFrame = data
+
+    def connect_to_db(self):
+        pass
+
+    def close_connection(self):
+        pass
+
+    def get_high_water_mark(self, operator=None):
+        return datetime(2022, 1, 20, 10, 0, 0)
+
+    def set_df(self, df):
+        self.df = df
+
+    def upsert(self):
+        FakePostgreSQL.upserted.append(self.df)
+
+
+class FakeAvaconAPI:
+    """
+    API answering with a curtailment starting at the high-water mark,
+    which was published after the last sync.
+    """
+    config: dict = {}
+
+    def __init__(self, config_path, config_name):
+        FakeAvaconAPI.config = {}
+
+    def set_config_value(self, key, value):
+        FakeAvaconAPI.config[key] = value
+
+    def call_api(self):
+        return pd.DataFrame({"ID": [1, 2],
+                             "Start": ["2022-01-20 10:00:00", "2022-01-20 11:00:00"],
+                             "Ende": ["2022-01-20 10:05:00", "2022-01-20 11:05:00"],
+                             "Dauer (Min)": [5, 5],
+                             "Stufe (%)": [30, 0],
+                             "Ursache": ["Netz", "Netz"],
+                             "Anlagenschlüssel": ["E456", "E123"],
+                             "Netzbetreiber": ["Avacon", "Avacon"]})
+
+    def close(self):
+        pass
+
+
+def test_sync_incremental_refetches_overlap(monkeypatch):
+    monkeypatch.setattr(pipeline, "PostgreSQL", FakePostgreSQL)
+    monkeypatch.setattr(pipeline, "AvaconAPI", FakeAvaconAPI)
+    FakePostgreSQL.upserted = []
+    df: pd.DataFrame = sync_incremental("", "avacon_api.json", "query.json",
+                                        lookback=timedelta(hours=2))
+    assert FakeAvaconAPI.config["val1"] == "2022-01-20 08:00:00"
+    assert df["plant_id"].tolist() == ["E456", "E123"]
+    assert len(FakePostgreSQL.upserted) == 1
+    assert FakePostgreSQL.upserted[0].shape[0] == 2
@@ -0,0 +1,265 @@
+"""Module to test postgresql.py functions"""
+# stdlib
+from datetime import datetime
+from io import StringIO
+
+# third party
+import pytest
+import pandas as pd
+from psycopg2 import sql
+
+# relative
+from tmh_server.postgresql import PostgreSQL
+
+COLUMNS: list = ["start_curtailment", "plant_id", "level", "power_nominal"]
+
+
+class FakeCursor:
+    """
+    Cursor remembering the executed queries and answering fetchone with
+    the queued results, fetchall with the tables, and the description
+    with the columns of the table.
+    """
+    def __init__(self,
+                 results: list=None,
+                 tables: list=None,
+                 columns: list=None,
+                 rows: list=None):
+        self.queries: list = []
+        self.results: list = results or []
+        self.tables: list = tables or []
+        self.columns: list = columns or []
+        self.rows: list = rows or []
+        self.fetched: list = []
+        self.description: list = None
+        self.copied: list = []
+        self.closed: bool = False
+        self.name: str = None
+        self.itersize: int = None
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+        self.description = [(c, None) for c in self.columns]
+
+    def fetchone(self):
+        return self.results.pop(0)
+
+    def fetchall(self):
+        return [(t,) for t in self.tables]
+
+    def fetchmany(self, size):
+        self.fetched.append(size)
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def copy_expert(self, query, stream):
+        self.queries.append((query, None))
+        self.copied.append(stream.read().decode("utf-8"))
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    """
+    Connection handing out one cursor and counting commits and rollbacks.
+    """
+    def __init__(self,
+                 cur: FakeCursor):
+        self.cur: FakeCursor = cur
+        self.commits: int = 0
+        self.rollbacks: int = 0
+
+    def cursor(self, name=None):
+        self.cur.name = name
+        return self.cur
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakePool:
+    """
+    Pool with a single connection, remembering whether it was returned.
+    """
+    def __init__(self,
+                 connection: FakeConnection):
+        self.connection: FakeConnection = connection
+        self.returned: bool = False
+
+    def getconn(self):
+        self.returned = False
+        return self.connection
+
+    def putconn(self, connection):
+        self.returned = True
+
+
+def fake_postgresql(cur: FakeCursor,
+                    data: pd.DataFrame=None) -> PostgreSQL:
+    psql: PostgreSQL = PostgreSQL(config_path="", config_name="", data=data)
+    psql.config = {"table_name": "curtailments"}
+    psql.pool = FakePool(FakeConnection(cur))
+    psql._get_pool = lambda host=None, port=None: psql.pool
+    return psql
+
+
+def to_string(query) -> str:
+    """
+    Render a psycopg2.sql query without a database connection.
+    """
+    if isinstance(query, sql.Composed):
+        return "".join(to_string(q) for q in query.seq)
+    if isinstance(query, sql.SQL):
+        return query.string
+    if isinstance(query, sql.Identifier):
+        return ".".join(f'"{s}"' for s in query.strings)
+    return str(query)
+
+
+def test_partition_bounds():
+    bounds: list = PostgreSQL._partition_bounds("2022-11-15 10:00:00", "2023-01-31 23:59:59")
+    assert bounds == [(datetime(2022, 11, 1), datetime(2022, 12, 1)),
+                      (datetime(2022, 12, 1), datetime(2023, 1, 1)),
+                      (datetime(2023, 1, 1), datetime(2023, 2, 1))]
+    assert PostgreSQL._partition_bounds("2022-03-31", "2022-03-31") == \
+        [(datetime(2022, 3, 1), datetime(2022, 4, 1))]
+
+
+def test_partition_name():
+    assert PostgreSQL._partition_name("curtailments", datetime(2022, 1, 1)) == "curtailments_y2022m01"
+
+
+def test_bucket_bounds():
+    assert PostgreSQL._bucket_bounds("2022-03-01 10:15:00", "2022-03-31 23:30:00", "hour") == \
+        (datetime(2022, 3, 1, 10), datetime(2022, 4, 1))
+    assert PostgreSQL._bucket_bounds("2022-03-01 10:15:00", "2022-03-02 08:00:00", "day") == \
+        (datetime(2022, 3, 1), datetime(2022, 3, 3))
+    assert PostgreSQL._bucket_bounds("2022-12-05 10:15:00", "2022-12-05 10:15:00", "month") == \
+        (datetime(2022, 12, 1), datetime(2023, 1, 1))
+
+
+def test_get_high_water_mark():
+    psql: PostgreSQL = PostgreSQL(config_path="", config_name="", data=pd.DataFrame())
+    psql.config = {"table_name": "curtailments"}
+    psql.cur = FakeCursor(results=[(datetime(2022, 1, 20, 10),)] * 2)
+    assert psql.get_high_water_mark() == datetime(2022, 1, 20, 10)
+    assert psql.get_high_water_mark("Avacon") == datetime(2022, 1, 20, 10)
+    assert psql.cur.queries[0][1] is None
+    assert psql.cur.queries[1][1] == ("Avacon",)
+    assert "operator" in repr(psql.cur.queries[1][0])
+
+
+def test_update_curtailed_power_refreshes_changed_range():
+    cur: FakeCursor = FakeCursor(results=[(2, datetime(2022, 3, 5), datetime(2022, 3, 9)),
+                                          (1, datetime(2022, 2, 1), datetime(2022, 2, 1))],
+                                 tables=["curtailments", "curtailments_by_hour"])
+    psql: PostgreSQL = fake_postgresql(cur)
+    psql.update_curtailed_power(delete_unmatched=True)
+    queries: list = [(to_string(q), p) for q, p in cur.queries]
+    assert "RETURNING c.start_curtailment" in queries[0][0]
+    assert "RETURNING c.start_curtailment" in queries[1][0]
+    deletes: list = [p for q, p in queries if q.startswith('DELETE FROM "curtailments_by_')]
+    assert deletes == [(datetime(2022, 2, 1), datetime(2022, 3, 9, 1)),
+                       (datetime(2022, 2, 1), datetime(2022, 3, 10)),
+                       (datetime(2022, 2, 1), datetime(2022, 4, 1))]
+    assert psql.pool.connection.commits == 1
+    assert psql.pool.returned
+
+
+def test_update_curtailed_power_without_changes():
+    cur: FakeCursor = FakeCursor(results=[(0, None, None)],
+                                 tables=["curtailments", "curtailments_by_hour"])
+    psql: PostgreSQL = fake_postgresql(cur)
+    psql.update_curtailed_power()
+    assert len(cur.queries) == 1
+
+
+def test_transaction_rolls_back_and_returns_connection():
+    cur: FakeCursor = FakeCursor(tables=["other"])
+    psql: PostgreSQL = fake_postgresql(cur, pd.DataFrame({"plant_id": ["E123"]}))
+    with pytest.raises(Exception, match="Insertion pipeline failed"):
+        psql.insert_batches([psql.df])
+    assert psql.pool.connection.rollbacks == 1
+    assert psql.pool.connection.commits == 0
+    assert psql.pool.returned
+    assert psql.connection is None
+
+
+def test_upsert_updates_columns_of_the_frame():
+    cur: FakeCursor = FakeCursor(results=[(False,)], tables=["curtailments"], columns=COLUMNS)
+    psql: PostgreSQL = fake_postgresql(cur, pd.DataFrame({
+        "start_curtailment": [datetime(2022, 1, 1, 10)] * 2,
+        "plant_id": ["E123", "E123"],
+        "level": [30, 60]}))
+    psql.upsert()
+    queries: list = [to_string(q) for q, _ in cur.queries]
+    insert: str = next(q for q in queries if q.startswith('INSERT INTO "curtailments"'))
+    assert insert.endswith('ON CONFLICT ("start_curtailment","plant_id") '
+                           'DO UPDATE SET "level" = EXCLUDED."level"')
+    # Duplicate keys are merged and missing columns are 0 in new rows
+    copied: pd.DataFrame = pd.read_csv(StringIO(cur.copied[0]), header=None, names=COLUMNS)
+    assert copied["level"].tolist() == [60]
+    assert copied["power_nominal"].tolist() == [0]
+    assert psql.pool.connection.commits == 1
+
+
+def test_upsert_without_update_columns():
+    cur: FakeCursor = FakeCursor(results=[(False,)], tables=["curtailments"], columns=COLUMNS)
+    psql: PostgreSQL = fake_postgresql(cur, pd.DataFrame({
+        "start_curtailment": [datetime(2022, 1, 1, 10)],
+        "plant_id": ["E123"]}))
+    psql.upsert()
+    insert: str = next(q for q in (to_string(q) for q, _ in cur.queries)
+                       if q.startswith('INSERT INTO "curtailments"'))
+    assert insert.endswith('ON CONFLICT ("start_curtailment","plant_id") DO NOTHING')
+
+
+def test_insert_batches():
+    cur: FakeCursor = FakeCursor(results=[(True,)], tables=["curtailments"], columns=COLUMNS)
+    psql: PostgreSQL = fake_postgresql(cur)
+    batches: list = [pd.DataFrame({"start_curtailment": [datetime(2022, 1, 31, 23)],
+                                   "plant_id": ["E123"], "level": [30]}),
+                     pd.DataFrame({"start_curtailment": [datetime(2022, 2, 1, 1)],
+                                   "plant_id": ["E456"], "level": [60]})]
+    rows: int = psql.insert_batches(batches, "2022-01-31", "2022-02-01")
+    queries: list = [to_string(q) for q, _ in cur.queries]
+    assert rows == 2
+    assert [q.split()[5] for q in queries if q.startswith("CREATE TABLE IF NOT EXISTS")] == \
+        ['"curtailments_y2022m01"', '"curtailments_y2022m02"']
+    assert sum(q.startswith('COPY "curtailments"') for q in queries) == 1
+    copied: pd.DataFrame = pd.read_csv(StringIO(cur.copied[0]), header=None, names=COLUMNS)
+    assert copied["plant_id"].tolist() == ["E123", "E456"]
+    assert copied["power_nominal"].tolist() == [0, 0]
+    assert psql.pool.connection.commits == 1
+
+
+def test_iter_rows():
+    cur: FakeCursor = FakeCursor(columns=["plant_id", "level"],
+                                 rows=[("E123", 30), ("E456", 60), ("E789", 0)])
+    psql: PostgreSQL = fake_postgresql(cur)
+    psql.connection = psql.pool.connection
+    batches: list = list(psql.iter_rows("curtailments", columns=["plant_id", "level"],
+                                        start="2022-01-01", end="2022-02-01", chunksize=2))
+    query, params = cur.queries[0]
+    assert to_string(query) == 'SELECT "plant_id","level" FROM "curtailments" WHERE ' \
+        '"start_curtailment" >= %s AND "start_curtailment" < %s'
+    assert params == ["2022-01-01", "2022-02-01"]
+    assert cur.name is not None
+    assert cur.itersize == 2
+    assert [b["plant_id"].tolist() for b in batches] == [["E123", "E456"], ["E789"]]
+    assert cur.closed
+
+
+def test_iter_rows_without_predicate():
+    cur: FakeCursor = FakeCursor(columns=["plant_id"], rows=[("E123",)])
+    psql: PostgreSQL = fake_postgresql(cur)
+    psql.connection = psql.pool.connection
+    batches: list = list(psql.iter_rows("curtailments"))
+    assert to_string(cur.queries[0][0]) == 'SELECT * FROM "curtailments"'
+    assert cur.queries[0][1] == []
+    assert cur.fetched == [psql.chunksize, psql.chunksize]
+    assert len(batches) == 1
@@ -1,6 +1,7 @@
 """Module to test process_data.py functions"""
 
 # third party
+import pytest
 import pandas as pd
 
 # relative
@@ -32,3 +33,43 @@ def test_clean():
                      "operator"] for e in df.columns)
     assert df.shape[0] == 2
     assert df["level"].isin([0, 30, 60]).all()
+
+
+def test_clean_reports_timings_and_keeps_input():
+    process_data: ProcessData = ProcessData(DF.copy())
+    process_data.clean()
+    assert set(process_data.timings.keys()) == {"build_mask", "select_columns", "col_to_datetime",
+                                                "sort_by_column", "validate_duration"}
+    assert process_data.get_data()["plant_id"].tolist() == ["E123", "E789"]
+    assert DF.shape[0] == 4
+
+
+def test_clean_applies_schema():
+    process_data: ProcessData = ProcessData(DF.copy())
+    process_data.clean()
+    df: pd.DataFrame = process_data.get_data()
+    assert df["level"].dtype == "int8"
+    assert df["duration"].dtype == "int16"
+    assert isinstance(df["cause"].dtype, pd.CategoricalDtype)
+
+
+def test_clean_batches():
+    batches: list = [DF.iloc[:2].copy(), DF.iloc[2:].copy(), DF.iloc[:1].copy()]
+    cleaned: list = list(ProcessData().clean_batches(batches))
+    assert [df["plant_id"].tolist() for df in cleaned] == [["E123"], ["E789"]]
+
+
+def test_clean_rejects_too_long_duration():
+    df: pd.DataFrame = DF.copy()
+    df.loc[0, "Ende"] = "2020-02-01 10:00:00"
+    with pytest.raises(ValueError, match="duration"):
+        ProcessData(df).clean()
+
+
+def test_clean_recomputes_invalid_raw_duration():
+    df: pd.DataFrame = DF.copy()
+    df["Dauer (Min)"] = [None, 5, 40000, 5]
+    process_data: ProcessData = ProcessData(df)
+    process_data.clean()
+    assert process_data.get_data()["duration"].tolist() == [5, 5]
+    assert process_data.get_data()["duration"].dtype == "int16"
@@ -7,6 +7,7 @@ import pandas as pd
 
 # relative
 from tmh_server import read_file as rf
+from tmh_server import write_file as wf
 
 TEST_DIR: str = "test"
 TEST_FILE_CSV: str = "test_data.csv"
@@ -42,3 +43,29 @@ def test_json_to_dict():
     assert all([item in ["fl_params", "training_params"] for item in config.keys()])
     assert all([item in ["server_address", "fl"] for item in config["fl_params"].keys()])
     assert all([item in ["data", "model", "python_exec"] for item in config["training_params"].keys()])
+
+
+def test_detect_encoding(tmp_path):
+    (tmp_path / "latin1.csv").write_bytes("Netzbetreiber;Leistung\nÜberlandwerk;1,5\n".encode("latin1"))
+    (tmp_path / "bom.csv").write_bytes("Humidity,VOC\n82.46,155\n".encode("utf-8-sig"))
+    assert rf.detect_encoding(str(tmp_path / "latin1.csv")) == "latin1"
+    assert rf.detect_encoding(str(tmp_path / "bom.csv")) == "utf-8-sig"
+    assert rf.detect_encoding(os.path.join(os.getcwd(), TEST_DIR, TEST_FILE_CSV)) == "utf-8"
+
+    df: pd.DataFrame = rf.csv_to_pd(str(tmp_path), "latin1.csv", separator=";", memory_map=True)
+    assert df["Netzbetreiber"].tolist() == ["Überlandwerk"]
+    df = rf.csv_to_pd(str(tmp_path), "bom.csv")
+    assert list(df.columns) == ["Humidity", "VOC"]
+
+
+def test_parquet_to_pd(tmp_path):
+    data: pd.DataFrame = pd.DataFrame({"start_curtailment": pd.to_datetime(["2022-01-01", "2022-01-02",
+                                                                            "2022-02-01"]),
+                                       "operator": ["Avacon", "E.DIS/AG", "Avacon"],
+                                       "level": [0, 30, 60]})
+    wf.pd_to_partitioned_parquet(data, path=str(tmp_path / "curtailments"))
+    df: pd.DataFrame = rf.parquet_to_pd(str(tmp_path), "curtailments",
+                                        columns=["level", "operator"],
+                                        filters=[("month", "==", "2022-01")])
+    assert sorted(df["level"].tolist()) == [0, 30]
+    assert sorted(df["operator"].astype(str).tolist()) == ["Avacon", "E.DIS/AG"]
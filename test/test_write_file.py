@@ -3,6 +3,7 @@
 import os
 
 # third party
+import pytest
 import pandas as pd
 
 # relative
@@ -24,3 +25,42 @@ def test_pd_to_csv():
                                     "col2": [4, 5, 6]}))
     assert wf.file_exists(os.path.join(os.getcwd(), TEST_DIR, TEST_FILE_CSV_WRITE))
     os.remove(os.path.join(os.getcwd(), TEST_DIR, TEST_FILE_CSV_WRITE))
+
+
+def test_pd_to_csv_infers_compression(tmp_path):
+    data: pd.DataFrame = pd.DataFrame({"a": [1]})
+    wf.pd_to_csv(data, path=str(tmp_path), file_name="data.csv.gz")
+    assert os.listdir(tmp_path) == ["data.csv.gz"]
+    with open(tmp_path / "data.csv.gz", "rb") as f:
+        assert f.read(2) == b"\x1f\x8b"
+    assert pd.read_csv(tmp_path / "data.csv.gz").equals(data)
+
+
+def test_pd_to_parquet_and_feather(tmp_path):
+    data: pd.DataFrame = pd.DataFrame({"col1": [1, 2, 3],
+                                       "col2": [4, 5, 6]})
+    wf.pd_to_parquet(data, path=str(tmp_path), file_name="data.parquet", row_group_size=1)
+    wf.pd_to_feather(data, path=str(tmp_path), file_name="data.feather")
+    assert sorted(os.listdir(tmp_path)) == ["data.feather", "data.parquet"]
+    assert pd.read_parquet(tmp_path / "data.parquet").equals(data)
+    assert pd.read_feather(tmp_path / "data.feather").equals(data)
+
+
+def test_pd_to_partitioned_parquet(tmp_path):
+    data: pd.DataFrame = pd.DataFrame({"start_curtailment": pd.to_datetime(["2022-01-01", "2022-01-02",
+                                                                            "2022-02-01"]),
+                                       "operator": ["Avacon", "E.DIS/AG", "Avacon"],
+                                       "level": [0, 30, 60]})
+    written: list = wf.pd_to_partitioned_parquet(data, path=str(tmp_path))
+    assert len(written) == 3
+    assert os.path.isfile(tmp_path / "month=2022-01" / "operator=E.DIS%2FAG" / "data.parquet")
+
+
+def test_pd_to_partitioned_parquet_rejects_missing_keys(tmp_path):
+    data: pd.DataFrame = pd.DataFrame({"start_curtailment": pd.to_datetime(["2022-01-01", None,
+                                                                            "2022-02-01"]),
+                                       "operator": ["Avacon", "Avacon", None],
+                                       "level": [0, 30, 60]})
+    with pytest.raises(ValueError, match="2 rows miss a value"):
+        wf.pd_to_partitioned_parquet(data, path=str(tmp_path))
+    assert not os.listdir(tmp_path)
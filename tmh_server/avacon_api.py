@@ -2,32 +2,121 @@
 # stdlib
 import io
 import time
+import random
 import logging
+import threading
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 # third party
 import pandas as pd
 from requests import Session, Request, Response
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
 
 # relative
 from tmh_server import read_file
+from tmh_server.avacon_cache import AvaconCache
+from tmh_server.schema import AVACON_DTYPES, apply_schema
+
+BASE_URL: str = "https://redispatch-run.azurewebsites.net/api/export"
+RETRY_STATUS_CODES: list = [429, 500, 502, 503, 504]
+# Maximum number of rows the API returns per request
+PAGE_SIZE: int = 99999
+# Narrowest window on Start requested after a saturated page
+MIN_WINDOW: timedelta = timedelta(minutes=1)
+# Operators of requests on a sub-range of Start, both bounds inclusive
+RANGE_OPERATORS: dict = {"op1": "gOE", "startOp": "ge", "op2": "lOE", "endOp": "le"}
+
+
+class RateLimit:
+    """
+    Spaces requests at least min_interval seconds apart, also across
+    threads sharing the instance.
+    """
+    def __init__(self,
+                 min_interval: float=0.0) -> None:
+        self.min_interval: float = min_interval
+        self.next_request: float = 0.0
+        self.lock: threading.Lock = threading.Lock()
+
+    def wait(self) -> None:
+        """
+        Block until the next request is allowed.
+        """
+        with self.lock:
+            now: float = time.monotonic()
+            delay: float = self.next_request - now
+            self.next_request = max(now, self.next_request) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
 
 
 class AvaconAPI:
     """
     Functions to work with the Avacon API.
+
+    All requests of an instance (and of the workers spawned by
+    call_api_parallel) share one pooled keep-alive session. Responses
+    with a status code in RETRY_STATUS_CODES, timeouts and dropped
+    connections are retried with jittered exponential backoff.
+
+    Requests of an instance and its workers are spaced at least
+    min_interval seconds apart, e.g. to respect the rate limit of an
+    operator.
+
+    If an AvaconCache is given, the window is fetched month by month
+    and closed months are served from the cache.
+
+    Saturated pages (PAGE_SIZE rows) are continued from the exact Start
+    of their last row, inclusive, and rows at that Start are told apart
+    by ID. Following pages are narrowed to a window on Start, which is
+    halved while pages stay saturated and doubled once they are complete.
     """
     def __init__(self,
                  config_path: str,
-                 config_name: str) -> None:
+                 config_name: str,
+                 base_url: str=BASE_URL,
+                 pool_size: int=10,
+                 max_retries: int=5,
+                 backoff_factor: float=1.0,
+                 max_backoff: float=60.0,
+                 timeout: float=300.0,
+                 session: Session=None,
+                 cache: AvaconCache=None,
+                 min_interval: float=0.0,
+                 rate_limit: RateLimit=None) -> None:
         # Config variables
         self.config_path: str = config_path
         self.config_name: str = config_name
         self.config: dict = {}
+        self.config_overrides: dict = {}
         self.config_keys: list = ["networkoperator", "type", "chunkNr",
                                   "param1", "op1", "startOp", "val1",
                                   "param2", "op2", "endOp", "val2"]
         self.len_reponse: int = 0
+        self.seen_ids: set = set()
+        self.pages: list = []
+
+        # Paging variables
+        self.cursor: datetime = None
+        self.end: datetime = None
+        self.end_param: str = None
+        self.window: timedelta = None
+        self.window_end: datetime = None
+        self.page_last_start: datetime = None
+
+        # Session variables
+        self.base_url: str = base_url
+        self.pool_size: int = pool_size
+        self.max_retries: int = max_retries
+        self.backoff_factor: float = backoff_factor
+        self.max_backoff: float = max_backoff
+        self.timeout: float = timeout
+        self.session: Session = session if session is not None else self._create_session()
+        self.cache: AvaconCache = cache
+        self.rate_limit: RateLimit = rate_limit if rate_limit is not None \
+            else RateLimit(min_interval)
 
         # Request variables
         self.request: Request = None
@@ -38,26 +127,209 @@ class AvaconAPI:
         """
         Call Avacon API based on a config file and process the response.
         """
+        if self.cache is not None:
+            return self.call_api_parallel(max_workers=1)
         start: int = time.time()
         if self._validate_config():
             print("All API calls can take up to 5 minutes. Please do not cancel the process.")
-            while self._data_missing():
-                self._build_request()
-                self._run_request()
-                self._extract_content()
-                self._start_to_datetime()
+            self.page_through()
+            print(f"API calls took {time.time() - start}s")
+            return self.content
+        logging.error("failed")
+        raise Exception("failed")
+
+    def call_api_parallel(self,
+                          max_workers: int=4,
+                          freq: str="MS") -> pd.DataFrame:
+        """
+        Call Avacon API concurrently. The val1..val2 window of the config
+        is split into independent sub-ranges (monthly by default), each
+        sub-range is paged through by its own worker and the results are
+        merged by ID.
+
+        Sub-ranges filter on the start of a curtailment for both bounds,
+        inclusive whatever operators the config uses, so that
+        curtailments crossing a sub-range boundary are not lost.
+        The end bound of the config is applied after merging.
+
+        :param max_workers: int, maximum number of concurrent requests
+        :param freq: str, pandas offset alias to split the window by,
+                     e.g. "MS" (month), "W" (week), "D" (day)
+        :return: pandas data frame, merged response of all sub-ranges
+        """
+        start: int = time.time()
+        if self._validate_config():
+            windows: list = self._split_window(freq)
+            print(f"Fetching {len(windows)} windows with {max_workers} workers")
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                frames: list = list(executor.map(self._fetch_window, windows))
+            self.content = self._merge_windows(frames)
             print(f"API calls took {time.time() - start}s")
             return self.content
         logging.error("failed")
         raise Exception("failed")
 
+    def iter_batches(self,
+                     chunksize: int=10000):
+        """
+        Call Avacon API based on a config file and parse each response
+        while it arrives. Instead of collecting all pages in memory,
+        data frame batches of at most chunksize rows are yielded, so
+        processing can start before the download finishes.
+
+        Batches are deduplicated by ID across pages and their Start
+        column is parsed to datetime. The batches are not sorted
+        against each other.
+
+        :param chunksize: int, maximum number of rows per batch
+        :return: generator, pandas data frames
+        """
+        if not self._validate_config():
+            logging.error("failed")
+            raise Exception("failed")
+        while self._data_missing():
+            self._build_request()
+            self._run_request(stream=True)
+            yield from self._stream_content(chunksize)
+
+    def get_window(self) -> tuple:
+        """
+        Get the val1..val2 window of the config, e.g. to prepare the
+        partitions of the database before streaming.
+
+        :return: tuple, first and last timestamp of the window
+        """
+        if not self._validate_config():
+            logging.error("failed")
+            raise Exception("failed")
+        return (self._parse_timestamp(self.config["val1"]),
+                self._parse_timestamp(self.config["val2"], end_of_day=True))
+
+    def set_config_value(self,
+                         key: str,
+                         value) -> None:
+        """
+        Override a value of the config file, e.g. val1 to start at the
+        latest record already stored in the database.
+
+        :param key: str, config key
+        :param value: any, value replacing the one of the config file
+        """
+        self.config_overrides[key] = value
+
     def _validate_config(self) -> bool:
         self.config: dict = read_file.json_to_dict(self.config_path,
                                                    self.config_name)
+        self.config.update(self.config_overrides)
         if all(e in list(self.config.keys()) for e in self.config_keys):
             return True
         return False
 
+    def page_through(self) -> pd.DataFrame:
+        """
+        Request all pages of the configured window and concatenate them.
+
+        :return: pandas data frame, response of the window
+        """
+        while self._data_missing():
+            self._build_request()
+            self._run_request()
+            self._extract_content()
+        self.content = self._concat_pages()
+        return self.content
+
+    def _split_window(self,
+                      freq: str) -> list:
+        """
+        Split the val1..val2 window of the config into sub-ranges.
+
+        :param freq: str, pandas offset alias to split the window by
+        :return: list, tuples of (start, end) timestamps as strings
+        """
+        first: datetime = self._parse_timestamp(self.config["val1"])
+        last: datetime = self._parse_timestamp(self.config["val2"], end_of_day=True)
+        boundaries: list = [first] + \
+            [b.to_pydatetime() for b in pd.date_range(first, last, freq=freq) if b > first] + \
+            [last + timedelta(seconds=1)]
+        return [(lower.strftime("%Y-%m-%d %H:%M:%S"),
+                 (upper - timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S"))
+                for lower, upper in zip(boundaries[:-1], boundaries[1:])]
+
+    def _fetch_window(self,
+                      window: tuple) -> pd.DataFrame:
+        """
+        Page through a single sub-range with its own request state.
+
+        :param window: tuple, (start, end) timestamps as strings
+        :return: pandas data frame, response of the sub-range
+        """
+        if self.cache is not None:
+            cached: pd.DataFrame = self.cache.get(self.config, window)
+            if cached is not None:
+                return cached
+        worker: AvaconAPI = self._spawn_worker()
+        worker.config = dict(self.config,
+                             val1=window[0],
+                             param2=self.config["param1"],
+                             val2=window[1],
+                             **RANGE_OPERATORS)
+        content: pd.DataFrame = worker.page_through()
+        if self.cache is not None:
+            self.cache.put(self.config, window, content)
+        return content
+
+    def _spawn_worker(self):
+        """
+        Create an instance with the same settings, sharing the session
+        but with its own request state.
+
+        :return: AvaconAPI, worker instance
+        """
+        return AvaconAPI(config_path=self.config_path,
+                         config_name=self.config_name,
+                         base_url=self.base_url,
+                         pool_size=self.pool_size,
+                         max_retries=self.max_retries,
+                         backoff_factor=self.backoff_factor,
+                         max_backoff=self.max_backoff,
+                         timeout=self.timeout,
+                         session=self.session,
+                         cache=self.cache,
+                         rate_limit=self.rate_limit)
+
+    def _merge_windows(self,
+                       frames: list) -> pd.DataFrame:
+        frames: list = [f for f in frames if not f.empty]
+        if not frames:
+            return pd.DataFrame()
+        content: pd.DataFrame = pd.concat(frames, ignore_index=True, sort=False)
+        content.drop_duplicates(subset=["ID"], inplace=True)
+        if self.config["param2"] == "end" and "Ende" in content.columns:
+            end: datetime = self._parse_timestamp(self.config["val2"], end_of_day=True)
+            content = content[pd.to_datetime(content["Ende"],
+                                             format="%Y-%m-%d %H:%M:%S") <= end]
+        content.sort_values(by=["Start"], ascending=True, inplace=True)
+        content.reset_index(drop=True, inplace=True)
+        return apply_schema(content, AVACON_DTYPES)
+
+    @staticmethod
+    def _parse_timestamp(value: str,
+                         end_of_day: bool=False) -> datetime:
+        """
+        Parse a config value given either as date or as timestamp.
+
+        :param value: str, "%Y-%m-%d" or "%Y-%m-%d %H:%M:%S"
+        :param end_of_day: bool, move a plain date to 23:59:59
+        :return: datetime, parsed value
+        """
+        try:
+            timestamp: datetime = datetime.strptime(value, "%Y-%m-%d")
+            if end_of_day:
+                timestamp += timedelta(hours=23, minutes=59, seconds=59)
+        except ValueError:
+            timestamp: datetime = datetime.strptime(value, "%Y-%m-%d %H:%M:%S")
+        return timestamp
+
     def _build_request(self,
                        data_type: str="csv",) -> str:
         """
@@ -67,7 +339,7 @@ class AvaconAPI:
         """
         available_types: list = ["csv", "xlsx", "pdf"]
         if data_type in available_types:
-            url: str = f"https://redispatch-run.azurewebsites.net/api/export/{data_type}"
+            url: str = f"{self.base_url}/{data_type}"
         else:
             logging.error("%s not in %s", data_type, available_types)
             raise Exception(f"{data_type} not in {available_types}")
@@ -76,53 +348,218 @@ class AvaconAPI:
                                         url=url,
                                         params=self.config).prepare()
 
-    def _run_request(self):
-        s: Session = Session()
-        self.response: Response = s.send(self.request)
+    def close(self) -> None:
+        """
+        Close the pooled session and all its connections.
+        """
+        self.session.close()
+
+    def _create_session(self) -> Session:
+        """
+        Create a keep-alive session with a connection pool of
+        pool_size connections and gzip negotiation.
+
+        :return: Session, pooled session
+        """
+        session: Session = Session()
+        adapter: HTTPAdapter = HTTPAdapter(pool_connections=self.pool_size,
+                                           pool_maxsize=self.pool_size,
+                                           max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Accept-Encoding": "gzip, deflate",
+                                "Connection": "keep-alive"})
+        return session
+
+    def _backoff(self,
+                 attempt: int,
+                 retry_after: str=None) -> None:
+        """
+        Sleep with full jitter exponential backoff. A numeric Retry-After
+        header of the server is used as lower bound.
+
+        :param attempt: int, number of the failed attempt starting at 0
+        :param retry_after: str, value of the Retry-After header
+        """
+        delay: float = random.uniform(0, min(self.max_backoff,
+                                             self.backoff_factor * 2 ** attempt))
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        logging.info("Retry %s in %.2fs", attempt + 1, delay)
+        time.sleep(delay)
+
+    def _run_request(self,
+                     stream: bool=False):
+        for attempt in range(self.max_retries + 1):
+            self.rate_limit.wait()
+            try:
+                self.response: Response = self.session.send(self.request,
+                                                            timeout=self.timeout,
+                                                            stream=stream)
+            except (Timeout, RequestsConnectionError) as e:
+                if attempt == self.max_retries:
+                    logging.error("API request failed after %s retries: %s", attempt, e)
+                    raise
+                logging.warning("API request failed: %s", e)
+                self._backoff(attempt)
+                continue
+            if self.response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                logging.warning("API request response is %s", self.response.status_code)
+                self.response.close()
+                self._backoff(attempt, self.response.headers.get("Retry-After"))
+                continue
+            break
+
         if self.response.status_code == 200:
             logging.info("API request response is %s", self.response.status_code)
-        elif self.response.status_code == 405:
-            logging.error("API request response is 405")
+        else:
+            logging.error("API request response is %s", self.response.status_code)
             raise Exception(f"API request response is {self.response.status_code}")
         return self.response
 
     def _extract_content(self) -> pd.DataFrame:
-        df: pd.DataFrame = pd.read_csv(io.StringIO(self.response.content.decode("utf-8")),
-                                       sep=";")
+        df: pd.DataFrame = pd.read_csv(io.BytesIO(self.response.content),
+                                       sep=";",
+                                       encoding="utf-8")
         self.len_reponse = df.shape[0]
+        self.page_last_start = None
+        print(f"Extracted {df.shape} data points from API")
+        df = self._prepare_page(df)
+        if not df.empty:
+            self.pages.append(df)
+        return df
+
+    def _stream_content(self,
+                        chunksize: int):
+        """
+        Parse the raw byte stream of a streamed response in chunks.
+
+        :param chunksize: int, maximum number of rows per batch
+        :return: generator, pandas data frames
+        """
+        self.len_reponse = 0
+        self.page_last_start = None
+        self.response.raw.decode_content = True
+        try:
+            with pd.read_csv(self.response.raw, sep=";",
+                             encoding="utf-8", chunksize=chunksize) as reader:
+                for df in reader:
+                    self.len_reponse += df.shape[0]
+                    df = self._prepare_page(df)
+                    if not df.empty:
+                        yield df
+        except pd.errors.EmptyDataError:
+            logging.warning("API response is empty")
+        finally:
+            self.response.close()
+        print(f"Streamed {self.len_reponse} data points from API")
+
+    def _prepare_page(self,
+                      df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Keep only rows with an ID not seen on earlier pages and parse
+        their Start column. Only the new rows of a page are touched,
+        so the work per page does not grow with the pages before it.
+        The latest Start of the whole page is kept as paging cursor.
+
+        :param df: pandas data frame, rows of a single page
+        :return: pandas data frame, new rows of the page
+        """
         df.columns = df.columns.str.replace('"', "")
-        if self.content.empty:
-            self.content = df
-            print(f"Extracted {df.shape} data points from API")
-        else:
-            self.content = pd.concat([self.content, df], ignore_index=True, sort=False)
-            self.content.drop_duplicates(subset=["ID"], inplace=True)
-            print(f"Extracted {df.shape} data points from API")
-
-    def _start_to_datetime(self):
-        if "Start" in self.content.columns:
-            self.content["Start"] = pd.to_datetime(self.content["Start"],
-                                                   format="%Y-%m-%d %H:%M:%S")
-            self.content.sort_values(by=["Start"],
-                                     ascending=True,
-                                     inplace=True)
-            self.content.reset_index(drop=True,
-                                     inplace=True)
-        else:
-            logging.error("Start not in data frame columns %s", self.content.columns)
-            raise KeyError(f"Start not in data frame columns {self.content.columns}")
+        if "ID" not in df.columns:
+            logging.error("ID not in data frame columns %s", df.columns)
+            raise KeyError(f"ID not in data frame columns {df.columns}")
+        if "Start" in df.columns and not df.empty:
+            # Timestamps in this format sort like strings
+            page_last_start: datetime = datetime.strptime(str(df["Start"].max()),
+                                                          "%Y-%m-%d %H:%M:%S")
+            if self.page_last_start is None or page_last_start > self.page_last_start:
+                self.page_last_start = page_last_start
+        df = df[~df["ID"].isin(self.seen_ids)].drop_duplicates(subset=["ID"])
+        self.seen_ids.update(df["ID"])
+        df = self._start_to_datetime(df)
+        if self.end_param == "end" and "Ende" in df.columns:
+            # Windows filter on Start, so the end bound of the config is
+            # applied here
+            df = df[pd.to_datetime(df["Ende"], format="%Y-%m-%d %H:%M:%S") <= self.end]
+        return df
+
+    def _concat_pages(self) -> pd.DataFrame:
+        """
+        Concatenate and sort all collected pages once.
+
+        :return: pandas data frame, content of all pages
+        """
+        if not self.pages:
+            return pd.DataFrame()
+        content: pd.DataFrame = pd.concat(self.pages, ignore_index=True, sort=False)
+        content.sort_values(by=["Start"], ascending=True, inplace=True, kind="stable")
+        content.reset_index(drop=True, inplace=True)
+        return apply_schema(content, AVACON_DTYPES)
+
+    @staticmethod
+    def _start_to_datetime(df: pd.DataFrame) -> pd.DataFrame:
+        if "Start" in df.columns:
+            df = df.copy()
+            df["Start"] = pd.to_datetime(df["Start"],
+                                         format="%Y-%m-%d %H:%M:%S")
+            return df
+        logging.error("Start not in data frame columns %s", df.columns)
+        raise KeyError(f"Start not in data frame columns {df.columns}")
 
     def _data_missing(self) -> bool:
-        try:
-            end: datetime = datetime.strptime(self.config["val2"], "%Y-%m-%d")
-            end += timedelta(hours=23, minutes=59, seconds=59)
-        except ValueError:
-            end: datetime = datetime.strptime(self.config["val2"], "%Y-%m-%d %H:%M:%S")
+        """
+        Decide whether another page has to be requested and move the
+        cursor and window of the config accordingly.
 
-        if self.content.empty:
+        :return: bool, True if another page is requested
+        """
+        if self.response is None:
+            self.cursor = self._parse_timestamp(self.config["val1"])
+            self.end = self._parse_timestamp(self.config["val2"], end_of_day=True)
+            self.end_param = self.config["param2"]
             return True
-        if self.content.iloc[-1]["Start"] <= end and self.len_reponse >= 99999:
-            self.config["val1"] = self.content.iloc[-1]["Start"].strftime("%Y-%m-%d")
-            print("New start:", self.config["val1"])
+        if self.len_reponse >= PAGE_SIZE:
+            return self._continue_saturated()
+        if self.window is not None and self.window_end < self.end:
+            self._move_window(self.window_end + timedelta(seconds=1), self.window * 2)
             return True
         return False
+
+    def _continue_saturated(self) -> bool:
+        """
+        Continue after a saturated page at the exact Start of its last
+        row. The next window on Start spans as much time as the page did
+        and is halved while pages stay saturated. A page whose rows all
+        start at the cursor can not be continued, as the API has no
+        filter on ID.
+
+        :return: bool, True if another page is requested
+        """
+        if self.page_last_start is None or self.page_last_start <= self.cursor:
+            logging.error("More than %s curtailments start at %s", PAGE_SIZE, self.cursor)
+            raise Exception(f"More than {PAGE_SIZE} curtailments start at {self.cursor}")
+        window: timedelta = self.page_last_start - self.cursor if self.window is None \
+            else self.window / 2
+        self._move_window(self.page_last_start, max(window, MIN_WINDOW))
+        return True
+
+    def _move_window(self,
+                     cursor: datetime,
+                     window: timedelta) -> None:
+        """
+        Request the curtailments starting between cursor and the end of
+        the window next. The cursor is inclusive, rows at the cursor
+        which were already seen are dropped by ID.
+
+        :param cursor: datetime, earliest Start of the next page
+        :param window: timedelta, width of the window on Start
+        """
+        self.cursor = cursor
+        self.window = window
+        self.window_end = min(cursor + window, self.end)
+        self.config.update(val1=cursor.strftime("%Y-%m-%d %H:%M:%S"),
+                           param2=self.config["param1"],
+                           val2=self.window_end.strftime("%Y-%m-%d %H:%M:%S"),
+                           **RANGE_OPERATORS)
+        print("New start:", self.config["val1"], "end:", self.config["val2"])
@@ -0,0 +1,89 @@
+"""Module to cache responses of the Avacon API on disk"""
+# stdlib
+import os
+import re
+import time
+import logging
+from datetime import datetime, timedelta
+
+# third party
+import pandas as pd
+
+# relative
+from tmh_server import read_file, write_file
+
+
+class AvaconCache:
+    """
+    Stores the response of the Avacon API for a date window as Parquet
+    file, keyed by network operator, type and date window.
+
+    Windows ending before the current month are closed and reused until
+    they are older than ttl_closed. Windows reaching into the current
+    month are never served from the cache and always refetched.
+    """
+    def __init__(self,
+                 cache_dir: str,
+                 ttl_closed: timedelta=timedelta(days=30)) -> None:
+        self.cache_dir: str = cache_dir
+        self.ttl_closed: timedelta = ttl_closed
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self,
+            config: dict,
+            window: tuple) -> pd.DataFrame:
+        """
+        Return the cached response of a window if it is still fresh.
+
+        :param config: dict, Avacon API config
+        :param window: tuple, (start, end) timestamps as strings
+        :return: pandas data frame or None, cached response
+        """
+        full_path: str = self._full_path(config, window)
+        if not os.path.isfile(full_path) or not self._is_fresh(full_path, window):
+            return None
+        logging.info("Cache hit for %s", full_path)
+        return read_file.parquet_to_pd(self.cache_dir, os.path.basename(full_path))
+
+    def put(self,
+            config: dict,
+            window: tuple,
+            df: pd.DataFrame) -> None:
+        """
+        Store the response of a window. The file is written atomically.
+
+        :param config: dict, Avacon API config
+        :param window: tuple, (start, end) timestamps as strings
+        :param df: pandas data frame, response of the window
+        """
+        write_file.pd_to_parquet(df,
+                                 path=self.cache_dir,
+                                 file_name=os.path.basename(self._full_path(config, window)),
+                                 overwrite=True)
+
+    def _full_path(self,
+                   config: dict,
+                   window: tuple) -> str:
+        key: str = "_".join([str(config["networkoperator"]),
+                             str(config["type"]),
+                             window[0], window[1]])
+        return os.path.join(self.cache_dir,
+                            re.sub(r"[^A-Za-z0-9_-]", "", key) + ".parquet")
+
+    def _is_fresh(self,
+                  full_path: str,
+                  window: tuple) -> bool:
+        """
+        Closed windows are fresh until they exceed ttl_closed, windows
+        of the current month are never fresh.
+
+        :param full_path: str, path of cached file
+        :param window: tuple, (start, end) timestamps as strings
+        :return: bool, True if cached file can be used
+        """
+        current_month: datetime = datetime.now().replace(day=1, hour=0, minute=0,
+                                                         second=0, microsecond=0)
+        if datetime.strptime(window[1], "%Y-%m-%d %H:%M:%S") >= current_month:
+            return False
+        age: float = time.time() - os.path.getmtime(full_path)
+        return age < self.ttl_closed.total_seconds()
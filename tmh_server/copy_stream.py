@@ -0,0 +1,201 @@
+"""Module to stream pandas data frames into PostgreSQL COPY"""
+# stdlib
+import io
+import struct
+from decimal import Decimal
+
+# third party
+import numpy as np
+import pandas as pd
+
+PG_EPOCH: pd.Timestamp = pd.Timestamp("2000-01-01")
+BINARY_HEADER: bytes = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+BINARY_TRAILER: bytes = struct.pack(">h", -1)
+NULL: bytes = struct.pack(">i", -1)
+
+# PostgreSQL type OIDs to big-endian numpy types for fixed width columns
+FIXED_WIDTH_TYPES: dict = {16: ">?",     # boolean
+                           20: ">i8",    # bigint
+                           21: ">i2",    # smallint
+                           23: ">i4",    # integer
+                           700: ">f4",   # real
+                           701: ">f8",   # double precision
+                           1114: ">i8"}  # timestamp without time zone
+TEXT_TYPES: list = [25, 1043]            # text, character varying
+NUMERIC_TYPE: int = 1700
+
+
+class CopyStream(io.RawIOBase):
+    """
+    File-like object reading from a generator of bytes. Passed to
+    cursor.copy_expert, a COPY consumes the generator chunk by chunk
+    without the whole data frame ever being serialized at once.
+    """
+    def __init__(self,
+                 chunks) -> None:
+        super().__init__()
+        self.chunks = chunks
+        self.buffer: bytes = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self.buffer:
+            try:
+                self.buffer = next(self.chunks)
+            except StopIteration:
+                return 0
+        size: int = min(len(b), len(self.buffer))
+        b[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+def csv_chunks(df: pd.DataFrame,
+               columns: list,
+               chunksize: int):
+    """
+    Serialize a data frame to quoted CSV in chunks of rows.
+
+    :param df: pandas data frame, data to serialize
+    :param columns: list, columns in order of the COPY column list
+    :param chunksize: int, number of rows per chunk
+    :return: generator, bytes
+    """
+    return csv_batches([df], columns, chunksize)
+
+
+def csv_batches(batches,
+                columns: list,
+                chunksize: int):
+    """
+    Serialize data frame batches to quoted CSV in chunks of rows.
+
+    :param batches: iterable, pandas data frames
+    :param columns: list, columns in order of the COPY column list
+    :param chunksize: int, number of rows per chunk
+    :return: generator, bytes
+    """
+    for df in batches:
+        for i in range(0, df.shape[0], chunksize):
+            yield df[columns].iloc[i:i + chunksize].to_csv(index=False,
+                                                           header=False).encode("utf-8")
+
+
+def binary_chunks(df: pd.DataFrame,
+                  columns: list,
+                  type_oids: list,
+                  chunksize: int):
+    """
+    Serialize a data frame to the binary COPY format of PostgreSQL in
+    chunks of rows.
+
+    :param df: pandas data frame, data to serialize
+    :param columns: list, columns in order of the COPY column list
+    :param type_oids: list, PostgreSQL type OIDs of the columns
+    :param chunksize: int, number of rows per chunk
+    :return: generator, bytes
+    """
+    return binary_batches([df], columns, type_oids, chunksize)
+
+
+def binary_batches(batches,
+                   columns: list,
+                   type_oids: list,
+                   chunksize: int):
+    """
+    Serialize data frame batches to the binary COPY format of
+    PostgreSQL in chunks of rows.
+
+    :param batches: iterable, pandas data frames
+    :param columns: list, columns in order of the COPY column list
+    :param type_oids: list, PostgreSQL type OIDs of the columns
+    :param chunksize: int, number of rows per chunk
+    :return: generator, bytes
+    """
+    yield BINARY_HEADER
+    field_count: bytes = struct.pack(">h", len(columns))
+    for df in batches:
+        for i in range(0, df.shape[0], chunksize):
+            chunk: pd.DataFrame = df.iloc[i:i + chunksize]
+            fields: list = [encode_column(chunk[c], oid) for c, oid in zip(columns, type_oids)]
+            yield b"".join(field_count + b"".join(row) for row in zip(*fields))
+    yield BINARY_TRAILER
+
+
+def encode_column(series: pd.Series,
+                  type_oid: int) -> list:
+    """
+    Encode all values of a column as length-prefixed binary fields.
+
+    :param series: pandas series, values of a column
+    :param type_oid: int, PostgreSQL type OID of the target column
+    :return: list, bytes per row
+    """
+    isnull: np.ndarray = series.isna().to_numpy()
+    if type_oid in FIXED_WIDTH_TYPES:
+        if type_oid == 1114:
+            values: np.ndarray = pd.to_datetime(series).to_numpy(dtype="datetime64[us]") \
+                .astype("int64") - PG_EPOCH.value // 1000
+        elif type_oid in [20, 21, 23]:
+            values: np.ndarray = series.fillna(0).to_numpy()
+        else:
+            values: np.ndarray = series.to_numpy()
+        dtype: np.dtype = np.dtype(FIXED_WIDTH_TYPES[type_oid])
+        packed: np.ndarray = np.empty(len(series), dtype=[("length", ">i4"), ("value", dtype)])
+        packed["length"] = dtype.itemsize
+        packed["value"] = values.astype(dtype)
+        raw: bytes = packed.tobytes()
+        width: int = packed.dtype.itemsize
+        encoded: list = [raw[j:j + width] for j in range(0, len(raw), width)]
+    elif type_oid in TEXT_TYPES:
+        encoded: list = [struct.pack(">i", len(v)) + v for v in
+                         (str(v).encode("utf-8") for v in series.astype(object).to_numpy())]
+    elif type_oid == NUMERIC_TYPE:
+        encoded: list = [encode_numeric(v) for v in series.astype(object).to_numpy()]
+    else:
+        raise TypeError(f"Column {series.name} has type OID {type_oid} without binary encoder")
+    return [NULL if n else e for e, n in zip(encoded, isnull)]
+
+
+def encode_numeric(value) -> bytes:
+    """
+    Encode a number as length-prefixed field of PostgreSQL's binary
+    NUMERIC format (base 10000 digits).
+
+    :param value: int, float, or Decimal, value to encode
+    :return: bytes, encoded field
+    """
+    if pd.isna(value):
+        return NULL
+    number: Decimal = Decimal(str(value))
+    if number.is_nan():
+        return struct.pack(">ihhhh", 8, 0, 0, 0xC000, 0)
+    if number.is_infinite():
+        raise ValueError(f"{value} can not be stored as numeric")
+    sign, digits, exponent = number.as_tuple()
+    digits_str: str = "".join(map(str, digits))
+    if exponent > 0:
+        digits_str += "0" * exponent
+        exponent = 0
+    if len(digits_str) < -exponent:
+        digits_str = "0" * (-exponent - len(digits_str)) + digits_str
+    integer_part: str = digits_str[:len(digits_str) + exponent]
+    fraction_part: str = digits_str[len(digits_str) + exponent:]
+    integer_part = integer_part.zfill((len(integer_part) + 3) // 4 * 4)
+    fraction_part = fraction_part.ljust((len(fraction_part) + 3) // 4 * 4, "0")
+    groups: list = [int(integer_part[j:j + 4]) for j in range(0, len(integer_part), 4)] + \
+        [int(fraction_part[j:j + 4]) for j in range(0, len(fraction_part), 4)]
+    weight: int = len(integer_part) // 4 - 1
+    while groups and groups[0] == 0:
+        groups.pop(0)
+        weight -= 1
+    while groups and groups[-1] == 0:
+        groups.pop()
+    if not groups:
+        weight = 0
+    header: bytes = struct.pack(">hhhh", len(groups), weight,
+                                0x4000 if sign else 0x0000, max(0, -exponent))
+    body: bytes = struct.pack(f">{len(groups)}h", *groups)
+    return struct.pack(">i", len(header) + len(body)) + header + body
@@ -2,15 +2,28 @@
 # stdlib
 import os
 import logging
+from datetime import datetime
 
 # third party
+import numpy as np
 import pandas as pd
 
+# relative
+from tmh_server import read_file, write_file
+from tmh_server.schema import CURTAILMENT_DTYPES, apply_schema
+
+MASTR_FILE: str = "mastr_2022_simplified.csv"
+
 
 class Mapping:
     """
     Get and map IDs from different data sources to extract
     the nominal power for a given plant ID.
+
+    The mapping can either be created from the merged SNBs on every run
+    (get_merged_snbs and create_mapping) or be loaded from a prebuilt
+    plant index (load_plant_index), which is rebuilt only if the merged
+    SNBs change.
     """
     def __init__(self,
                  path_anlagenstammdaten: str,
@@ -19,8 +32,10 @@ class Mapping:
         self.file_bewegungsdaten: str = file_bewegungsdaten
 
         self.mapping_id_to_power: dict = {}
+        self.plant_index: pd.Series = None
         self.df_db: pd.DataFrame = pd.DataFrame()
         self.df_mastr: pd.DataFrame = pd.DataFrame()
+        self.df_unmatched: pd.DataFrame = pd.DataFrame()
 
     def set_df(self,
                df: pd.DataFrame) -> None:
@@ -28,7 +43,7 @@ class Mapping:
         Setter for internal variable
         :param df: pandas dataframe, data to write to database
         """
-        self.df_db: pd.DataFrame = df
+        self.df_db: pd.DataFrame = apply_schema(df)
 
     def get_nb_mastr_nrs(self) -> list:
         """
@@ -63,11 +78,70 @@ class Mapping:
         Read merged data from all SNBs.
         """
         self.df_mastr: pd.DataFrame = pd.read_csv(os.path.join(self.path_anlagenstammdaten,
-                                                               "mastr_2022_simplified.csv"),
+                                                               MASTR_FILE),
                                                   sep=";",
                                                   usecols=["EEG-Anlagenschlüssel",
                                                            "Nettonennleistung der Einheit"])
 
+    def load_plant_index(self,
+                         snapshot: str=None) -> pd.Series:
+        """
+        Load the plant index of a MaStR snapshot: plant IDs sorted with
+        their nominal power already parsed to float, stored as Parquet
+        next to the merged SNBs and read memory-mapped. The index is
+        rebuilt if it does not exist or if the merged SNBs changed since
+        it was built.
+
+        :param snapshot: str, | snapshot date of the merged SNBs, defaults
+                              | to the modification date of the file
+        :return: pandas series, nominal power indexed by plant ID
+        """
+        source: str = os.path.join(self.path_anlagenstammdaten, MASTR_FILE)
+        stat: os.stat_result = os.stat(source)
+        snapshot: str = snapshot or datetime.fromtimestamp(stat.st_mtime).strftime("%Y-%m-%d")
+        index_path: str = os.path.join(self.path_anlagenstammdaten,
+                                       f"plant_index_{snapshot}.parquet")
+        signature: dict = {"source": MASTR_FILE,
+                           "size": stat.st_size,
+                           "mtime_ns": stat.st_mtime_ns}
+        if not os.path.isfile(index_path) or \
+                self._read_plant_index_signature(index_path) != signature:
+            self._build_plant_index(index_path, signature)
+        df: pd.DataFrame = read_file.parquet_to_pd(self.path_anlagenstammdaten,
+                                                   os.path.basename(index_path),
+                                                   memory_map=True)
+        self.plant_index = df.set_index("plant_id")["power_nominal"]
+        return self.plant_index
+
+    def _build_plant_index(self,
+                           index_path: str,
+                           signature: dict) -> None:
+        """
+        Parse the merged SNBs and store the sorted plant index together
+        with the signature of the parsed file.
+
+        :param index_path: str, path of Parquet file
+        :param signature: dict, size and modification time of merged SNBs
+        """
+        logging.info("Building plant index %s", index_path)
+        self.get_merged_snbs()
+        df: pd.DataFrame = self.get_plant_power().sort_values(by="plant_id")
+        write_file.pd_to_parquet(df,
+                                 path=os.path.dirname(index_path),
+                                 file_name=os.path.basename(index_path),
+                                 overwrite=True)
+        write_file.dict_to_json(signature,
+                                path=os.path.dirname(index_path),
+                                file_name=os.path.basename(index_path) + ".json")
+
+    @staticmethod
+    def _read_plant_index_signature(index_path: str) -> dict:
+        try:
+            return read_file.json_to_dict(os.path.dirname(index_path),
+                                          os.path.basename(index_path) + ".json")
+        except (OSError, ValueError):
+            return {}
+
     def create_mapping(self) -> dict:
         """
 
@@ -81,17 +155,94 @@ class Mapping:
             logging.error("Column EEG-Anlagenschlüssel not in dataframe")
             raise KeyError("Column EEG-Anlagenschlüssel not in dataframe")
 
+    def get_plant_power(self) -> pd.DataFrame:
+        """
+        Get the nominal power of each power plant from the merged SNBs,
+        e.g. to load it into the database once.
+
+        :return: pandas dataframe, columns plant_id and power_nominal in kW
+        """
+        if "EEG-Anlagenschlüssel" not in self.df_mastr.columns:
+            logging.error("Column EEG-Anlagenschlüssel not in dataframe")
+            raise KeyError("Column EEG-Anlagenschlüssel not in dataframe")
+        df: pd.DataFrame = self.df_mastr.rename(
+            columns={"EEG-Anlagenschlüssel": "plant_id",
+                     "Nettonennleistung der Einheit": "power_nominal"})
+        df = df[["plant_id", "power_nominal"]].dropna(subset=["plant_id"])
+        df["power_nominal"] = pd.to_numeric(df["power_nominal"].astype(str).str.replace(",", "."),
+                                            errors="coerce") \
+            .astype(CURTAILMENT_DTYPES["power_nominal"])
+        return df.dropna(subset=["power_nominal"]).drop_duplicates(subset=["plant_id"],
+                                                                   keep="last")
+
     def map_power_to_plant_id(self):
         """
         Map power plant IDs to their nominal power.
+
+        plant_id is factorized once, so the lookup and the parsing of
+        the nominal power run once per distinct plant instead of once per
+        curtailment. Curtailments of power plants without nominal power
+        are removed from df_db and kept in df_unmatched.
         """
-        if "power_nominal" in self.df_db.columns and "plant_id" in self.df_db.columns:
-            self.df_db["power_nominal"] = self.df_db["plant_id"].map(self.mapping_id_to_power)
-            self.df_db.dropna(subset=["power_nominal"], inplace=True)
-            self.df_db["power_nominal"] = self.df_db["power_nominal"].str.replace(",", ".").astype(float)
-        else:
+        if "power_nominal" not in self.df_db.columns or "plant_id" not in self.df_db.columns:
             logging.error("Columns not in dataframe")
             raise KeyError("Columns not in dataframe")
+        lookup: pd.Series = self.plant_index if self.plant_index is not None \
+            else pd.Series(self.mapping_id_to_power, dtype=object)
+        codes, uniques = pd.factorize(self.df_db["plant_id"])
+        positions: np.ndarray = lookup.index.get_indexer(np.asarray(uniques, dtype=object))
+        matched: np.ndarray = positions >= 0
+        values: np.ndarray = lookup.to_numpy()[positions[matched]]
+        if self.plant_index is None:
+            values = pd.to_numeric(
+                pd.Series(values, dtype=object).astype(str).str.replace(",", "."),
+                errors="coerce").to_numpy()
+        # Last element is NaN to map missing plant IDs (code -1)
+        power_uniques: np.ndarray = np.full(len(uniques) + 1, np.nan,
+                                            dtype=CURTAILMENT_DTYPES["power_nominal"])
+        power_uniques[:-1][matched] = values
+        power: np.ndarray = power_uniques[codes]
+
+        unmatched: np.ndarray = np.isnan(power)
+        self.df_unmatched = self.df_db[unmatched]
+        if unmatched.any():
+            logging.warning("No nominal power for %s curtailments of %s plant IDs",
+                            unmatched.sum(), self.df_unmatched["plant_id"].nunique())
+        self.df_db = self.df_db[~unmatched].assign(power_nominal=power[~unmatched])
+
+    def get_unmatched_plant_ids(self) -> pd.Series:
+        """
+        Get the plant IDs without nominal power of the last mapping.
+
+        :return: pandas series, number of curtailments per plant ID
+        """
+        counts: pd.Series = self.df_unmatched["plant_id"].value_counts()
+        return counts[counts > 0]
+
+    def map_batches(self,
+                    batches):
+        """
+        Map nominal power and calculate curtailed power and energy for
+        data frame batches one at a time, e.g. from
+        ProcessData.clean_batches or PostgreSQL.iter_rows. The mapping
+        has to be created beforehand with create_mapping or
+        load_plant_index.
+
+        :param batches: iterable, pandas dataframes
+        :return: generator, pandas dataframes with power and energy
+        """
+        if not self.mapping_id_to_power and self.plant_index is None:
+            logging.error("Mapping is empty, call create_mapping first")
+            raise KeyError("Mapping is empty, call create_mapping first")
+        for batch in batches:
+            if "power_nominal" not in batch.columns:
+                batch = batch.assign(power_nominal=0.0)
+            self.set_df(batch)
+            self.map_power_to_plant_id()
+            self.calculate_curtailed_power()
+            self.calculate_curtailed_energy()
+            if not self.df_db.empty:
+                yield self.df_db
 
     def calculate_curtailed_power(self):
         """
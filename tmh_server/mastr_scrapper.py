@@ -3,25 +3,55 @@
 import os
 import time
 import logging
+import threading
+from queue import Queue, Empty
+from concurrent.futures import ProcessPoolExecutor
 from collections import namedtuple
-from urllib.parse import urlunparse
+from urllib.parse import urlparse, urlunparse
 
 # third party
 import pandas as pd
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.support import expected_conditions
+from selenium.webdriver.support.ui import WebDriverWait
+
+# relative
+from tmh_server import read_file, write_file
+
+# Columns of the SNBs needed to map plant IDs to nominal power
+SNB_COLUMNS: list = ["EEG-Anlagenschlüssel",
+                     "Nettonennleistung der Einheit",
+                     "Inbetriebnahmedatum der Einheit"]
+# Export button of the grid, missing if the network operator has no entries
+EXPORT_BUTTON: str = "#stromerzeugung .panel-heading .dropdown > .btn"
+# Notice shown by the grid instead of rows if the network operator has no entries
+NO_RECORDS: str = "#grid-stromerzeugung-erweitert .k-grid-norecords"
 
 
 class MastrScrapper:
     """
     Build URL and then downlaod information from Marktstammdatenregister
+
+    Each instance can use its own download directory, so several
+    instances can download in parallel without clashing on the file name
+    Stromerzeuger.csv. Instead of fixed sleeps, the browser waits up to
+    timeout seconds for each element and for the download to finish.
     """
-    def __init__(self) -> None:
+    def __init__(self,
+                 path_download: str=None,
+                 headless: bool=False,
+                 timeout: float=60,
+                 base_url: str="https://www.marktstammdatenregister.de") -> None:
         self.nb_mastr_nr: list = None
         self.url: str = None
-        self.path_download: str = os.path.join(os.environ["HOME"],
-                                               "Downloads")
+        self.path_download: str = path_download or os.path.join(os.environ["HOME"],
+                                                                "Downloads")
+        self.headless: bool = headless
+        self.timeout: float = timeout
+        self.base_url: str = base_url
+        self.keep_driver: bool = False
+        self.driver: webdriver.Firefox = None
 
     def set_nb_mastr_nr(self,
                         nb_mastr_nr: str):
@@ -40,9 +70,10 @@ class MastrScrapper:
             typename="Components",
             field_names=["scheme", "netloc", "params", "path", "query", "fragment"]
         )
+        base_url = urlparse(self.base_url)
         url: str = urlunparse(components(
-            scheme="https",
-            netloc="www.marktstammdatenregister.de",
+            scheme=base_url.scheme,
+            netloc=base_url.netloc,
             path="/MaStR/Einheit/Einheiten/ErweiterteOeffentlicheEinheitenuebersicht",
             params="",
             query=f"filter=Inbetriebnahmedatum%20der%20EEG-Anlage~lt~%2701.01.2023%27~and~MaStR-Nr.%20des%20Anschluss-Netzbetreibers~ct~%27{self.nb_mastr_nr}%27",
@@ -55,82 +86,317 @@ class MastrScrapper:
         Remove any files having a similar name as the one
         to download.
         """
-        if os.path.isfile(self.path_download):
+        if os.path.isfile(os.path.join(self.path_download, "Stromerzeuger.csv")):
             os.remove(os.path.join(self.path_download,
                                    "Stromerzeuger.csv"))
 
-    def download_via_link(self) -> None:
+    def _create_driver(self) -> webdriver.Firefox:
         """
-        
-        :param nb_mastr_nr: str, ID of network operator
+        Start Firefox downloading CSV files into path_download without
+        asking.
+
+        :return: webdriver.Firefox, browser
+        """
+        os.makedirs(self.path_download, exist_ok=True)
+        options: webdriver.FirefoxOptions = webdriver.FirefoxOptions()
+        if self.headless:
+            options.add_argument("-headless")
+        options.set_preference("browser.download.folderList", 2)
+        options.set_preference("browser.download.dir", os.path.abspath(self.path_download))
+        options.set_preference("browser.download.useDownloadDir", True)
+        options.set_preference("browser.helperApps.neverAsk.saveToDisk",
+                               "text/csv,application/csv,application/octet-stream")
+        return webdriver.Firefox(options=options)
+
+    def _click(self,
+               css_selector: str) -> None:
+        WebDriverWait(self.driver, self.timeout).until(
+            expected_conditions.element_to_be_clickable((By.CSS_SELECTOR, css_selector))).click()
+
+    def _has_entries(self) -> bool:
+        """
+        Wait until the reloaded grid shows either the export button or
+        the notice that no records exist.
+
+        :return: bool, True if the network operator has entries
+        """
+        WebDriverWait(self.driver, self.timeout).until(
+            lambda d: d.find_elements(By.CSS_SELECTOR, EXPORT_BUTTON) or
+            d.find_elements(By.CSS_SELECTOR, NO_RECORDS))
+        return not self.driver.find_elements(By.CSS_SELECTOR, NO_RECORDS)
+
+    def _download_finished(self, _) -> bool:
+        files: list = os.listdir(self.path_download)
+        return "Stromerzeuger.csv" in files and not any(f.endswith(".part") for f in files)
+
+    def clear_download_dir(self):
+        """
+        Remove the download and unfinished parts of earlier downloads,
+        which could otherwise be taken for the next network operator.
+        """
+        if not os.path.isdir(self.path_download):
+            return
+        for f in os.listdir(self.path_download):
+            if f.startswith("Stromerzeuger") or f.endswith(".part"):
+                os.remove(os.path.join(self.path_download, f))
+
+    def download_via_link(self) -> bool:
+        """
+        Download the power plants of the network operator. A network
+        operator without entries or with too many entries is skipped.
+        Timeouts are raised, as the download may still be incomplete.
+        Missing entries are detected on the page, as WebDriverWait
+        ignores NoSuchElementException until the timeout.
+
+        :return: bool, True if Stromerzeuger.csv was downloaded
         """
         self._remove_existing_stromerzeuger_files()
         self._build_url()
 
-        driver = webdriver.Firefox()
-        driver.get(self.url)
-        time.sleep(3)
+        if self.driver is None:
+            self.driver = self._create_driver()
+        self.driver.get(self.url)
 
         try:
-            driver.find_element(By.CSS_SELECTOR,
-                                "#grid-stromerzeugung-erweitert .gridReloadBtn").click()
-            time.sleep(5)
-            driver.find_element(By.CSS_SELECTOR,
-                                "#stromerzeugung .panel-heading .dropdown > .btn").click()
-            time.sleep(.5)
-            driver.find_element(By.CSS_SELECTOR,
-                                "#ui-id-2").click()
-            time.sleep(.5)
-            value_field = driver.find_element(By.CSS_SELECTOR,
-                                            "#countEinheit")
+            self._click("#grid-stromerzeugung-erweitert .gridReloadBtn")
+            if not self._has_entries():
+                logging.warning("No entries exist for %s", self.nb_mastr_nr)
+                return False
+            self._click(EXPORT_BUTTON)
+            self._click("#ui-id-2")
+            value_field = WebDriverWait(self.driver, self.timeout).until(
+                lambda d: d.find_element(By.CSS_SELECTOR, "#countEinheit").text.strip() and
+                d.find_element(By.CSS_SELECTOR, "#countEinheit"))
             value_field: str = value_field.text.replace(".", "")
+            if int(value_field) == 0:
+                logging.warning("No entries exist for %s", self.nb_mastr_nr)
+                self._click("#cancelButton")
+                return False
             if int(value_field) <= 20000:
-                driver.find_element(By.CSS_SELECTOR,
-                                    "#jsFunctionButton > .labeltext").click()
-                while "Stromerzeuger.csv" not in os.listdir(self.path_download):
-                    time.sleep(1)
-            else:
-                print(f"Skip {self.nb_mastr_nr} because of too many entries {int(value_field)}")
-                driver.find_element(By.CSS_SELECTOR,
-                                    "#cancelButton").click()
-        except NoSuchElementException:
-            logging.warning("No entries exist for %s", self.nb_mastr_nr)
-        driver.close()
-
-    def move_downloaded_file(self):
+                self._click("#jsFunctionButton > .labeltext")
+                WebDriverWait(self.driver, self.timeout).until(self._download_finished)
+                return True
+            print(f"Skip {self.nb_mastr_nr} because of too many entries {int(value_field)}")
+            self._click("#cancelButton")
+            return False
+        finally:
+            if not self.keep_driver:
+                self.close()
+
+    def close(self) -> None:
+        """
+        Quit the browser if it is running.
+        """
+        if self.driver is not None:
+            self.driver.quit()
+            self.driver = None
+
+    def move_downloaded_file(self,
+                             path_snbs: str=None):
         """
         Move file from download directory to project directory.
+
+        :param path_snbs: str, | target folder, defaults to
+                               | anlagenstammdaten/SNBs in the working directory
+        :return: bool, True if the file was moved
         """
         full_path: str = os.path.join(self.path_download,
                                       "Stromerzeuger.csv")
+        path_snbs: str = path_snbs or os.path.join(os.getcwd(), "anlagenstammdaten", "SNBs")
         if os.path.isfile(full_path):
-            os.rename(full_path,
-                      os.path.join(os.getcwd(),
-                                   "anlagenstammdaten", "SNBs",
-                                   self.nb_mastr_nr + ".csv"))
+            os.replace(full_path,
+                       os.path.join(path_snbs,
+                                    self.nb_mastr_nr + ".csv"))
+            return True
+        return False
 
     def merge_snbs_into_one_csv(self,
-                                path_anlagenstammdaten: str) -> None:
+                                path_anlagenstammdaten: str,
+                                max_workers: int=None) -> None:
         """
         Combines all individual SNB data set scrapped from Marktstammdatenregister
         into one CSV
 
-        :param path_anlagenstammdaten: str, 
+        SNB files are read in parallel with a process pool and only the
+        columns in SNB_COLUMNS are parsed. Each parsed SNB is kept as
+        Parquet file in SNBs/.merged together with the size and
+        modification time of its CSV, so SNB files unchanged since the
+        last merge are not parsed again. The merged CSV is written once.
+
+        :param path_anlagenstammdaten: str, path of folder with SNBs folder
+        :param max_workers: int, number of processes, defaults to CPU count
         """
+        start: int = time.time()
         snbs_path: str = os.path.join(path_anlagenstammdaten, "SNBs")
-        df: pd.DataFrame = pd.DataFrame()
-        for snb in [i for i in os.listdir(snbs_path) if ".csv" in i]:
-            df_snb: pd.DataFrame = pd.read_csv(os.path.join(snbs_path, snb),
-                                               sep=";")
-            df: pd.DataFrame = pd.concat([df, df_snb],
-                                         ignore_index=True,
-                                         sort=False)
-            if "Inbetriebnahmedatum der Einheit" in df.columns:
-                df["Inbetriebnahmedatum der Einheit"] = pd.to_datetime(df["Inbetriebnahmedatum der Einheit"],
-                                                                       format="%d/%M/%Y")
-                df = df[df["Inbetriebnahmedatum der Einheit"] <= "2023-01-01"]
-                df.to_csv(os.path.join(path_anlagenstammdaten, "mastr_2022.csv"),
-                          sep=";")
-            else:
-                logging.error("Column Inbetriebnahmedatum der Einheit not in dataframe")
-                raise KeyError()
+        merged_path: str = os.path.join(snbs_path, ".merged")
+        os.makedirs(merged_path, exist_ok=True)
+        snbs: list = sorted(i for i in os.listdir(snbs_path) if ".csv" in i)
+        if not snbs:
+            logging.warning("No SNBs in %s", snbs_path)
+            return
+
+        signatures: dict = {}
+        for snb in snbs:
+            stat: os.stat_result = os.stat(os.path.join(snbs_path, snb))
+            signatures[snb] = [stat.st_size, stat.st_mtime_ns]
+        try:
+            manifest: dict = read_file.json_to_dict(merged_path, "manifest.json")
+        except OSError:
+            manifest: dict = {}
+        if manifest == signatures and \
+                os.path.isfile(os.path.join(path_anlagenstammdaten, "mastr_2022.csv")):
+            print("No SNB changed since the last merge")
+            return
+
+        changed: list = [snb for snb in snbs if manifest.get(snb) != signatures[snb] or
+                         not os.path.isfile(os.path.join(merged_path, snb + ".parquet"))]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            paths: list = [os.path.join(snbs_path, snb) for snb in changed]
+            for snb, df_snb in zip(changed, executor.map(read_snb, paths)):
+                write_file.pd_to_parquet(df_snb, path=merged_path,
+                                         file_name=snb + ".parquet", overwrite=True)
+
+        df: pd.DataFrame = pd.concat([read_file.parquet_to_pd(merged_path, snb + ".parquet")
+                                      for snb in snbs],
+                                     ignore_index=True,
+                                     sort=False)
+        write_file.pd_to_csv(df,
+                             path=path_anlagenstammdaten,
+                             file_name="mastr_2022.csv",
+                             separator=";",
+                             index=True,
+                             overwrite=True)
+        write_file.dict_to_json(signatures, path=merged_path, file_name="manifest.json")
+        print(f"Merging {len(changed)} of {len(snbs)} SNBs took {time.time() - start}s")
+
+
+def read_snb(full_path: str) -> pd.DataFrame:
+    """
+    Read the columns in SNB_COLUMNS of a single SNB and keep power plants
+    commissioned before 2023. Defined on module level to run in a
+    process pool.
+
+    :param full_path: str, path of SNB CSV
+    :return: pandas data frame, power plants of SNB
+    """
+    df: pd.DataFrame = pd.read_csv(full_path,
+                                   sep=";",
+                                   dtype=str,
+                                   usecols=lambda c: c in SNB_COLUMNS)
+    if "Inbetriebnahmedatum der Einheit" not in df.columns:
+        logging.error("Column Inbetriebnahmedatum der Einheit not in dataframe")
+        raise KeyError("Column Inbetriebnahmedatum der Einheit not in dataframe")
+    df["Inbetriebnahmedatum der Einheit"] = pd.to_datetime(df["Inbetriebnahmedatum der Einheit"],
+                                                           format="%d/%m/%Y")
+    return df[df["Inbetriebnahmedatum der Einheit"] <= "2023-01-01"]
+
+
+class MastrScrapeScheduler:
+    """
+    Scrap the Marktstammdatenregister for many network operators with
+    n_workers headless browsers in parallel. Every worker keeps its
+    browser open and downloads into its own directory. Completed
+    NB_Mastr_Nrs are stored in a checkpoint file, so an interrupted run
+    continues with the remaining network operators.
+    """
+    def __init__(self,
+                 path_anlagenstammdaten: str,
+                 n_workers: int=4,
+                 headless: bool=True,
+                 timeout: float=60,
+                 base_url: str="https://www.marktstammdatenregister.de",
+                 checkpoint_name: str="scrap_checkpoint.json") -> None:
+        self.path_anlagenstammdaten: str = path_anlagenstammdaten
+        self.path_snbs: str = os.path.join(path_anlagenstammdaten, "SNBs")
+        self.n_workers: int = n_workers
+        self.headless: bool = headless
+        self.timeout: float = timeout
+        self.base_url: str = base_url
+        self.checkpoint_name: str = checkpoint_name
+
+        self.completed: set = set()
+        self.failed: dict = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def run(self,
+            nb_mastr_nrs: list) -> dict:
+        """
+        Download the power plants of all network operators not completed
+        in an earlier run.
+
+        :param nb_mastr_nrs: list, IDs of network operators
+        :return: dict, error message per failed ID of network operator
+        """
+        start: int = time.time()
+        os.makedirs(self.path_snbs, exist_ok=True)
+        self.completed = set(self._read_checkpoint())
+        self.failed = {}
+        queue: Queue = Queue()
+        for nb_mastr_nr in nb_mastr_nrs:
+            if nb_mastr_nr not in self.completed:
+                queue.put(nb_mastr_nr)
+        print(f"Scrapping {queue.qsize()} of {len(nb_mastr_nrs)} network operators "
+              f"with {self.n_workers} workers")
+
+        workers: list = [threading.Thread(target=self._work, args=(i, queue))
+                         for i in range(self.n_workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        print(f"Scrapping took {time.time() - start}s, {len(self.failed)} failed")
+        return self.failed
+
+    def _work(self,
+              worker_id: int,
+              queue: Queue) -> None:
+        """
+        Take network operators from the queue until it is empty.
+
+        :param worker_id: int, number of worker naming its download directory
+        :param queue: Queue, IDs of network operators
+        """
+        scrapper: MastrScrapper = MastrScrapper(
+            path_download=os.path.join(self.path_anlagenstammdaten, "downloads",
+                                       f"worker_{worker_id}"),
+            headless=self.headless,
+            timeout=self.timeout,
+            base_url=self.base_url)
+        scrapper.keep_driver = True
+        try:
+            while True:
+                try:
+                    nb_mastr_nr: str = queue.get_nowait()
+                except Empty:
+                    break
+                try:
+                    scrapper.set_nb_mastr_nr(nb_mastr_nr)
+                    if scrapper.download_via_link() and \
+                            not scrapper.move_downloaded_file(self.path_snbs):
+                        raise OSError(f"Download of {nb_mastr_nr} not found")
+                    self._mark_completed(nb_mastr_nr)
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.error("Scrapping %s failed: %s", nb_mastr_nr, e)
+                    with self.lock:
+                        self.failed[nb_mastr_nr] = str(e)
+                    # Restart the browser and drop a download, which may
+                    # still finish, for the next network operator
+                    scrapper.close()
+                    scrapper.clear_download_dir()
+        finally:
+            scrapper.close()
+
+    def _mark_completed(self,
+                        nb_mastr_nr: str) -> None:
+        with self.lock:
+            self.completed.add(nb_mastr_nr)
+            write_file.dict_to_json({"completed": sorted(self.completed)},
+                                    path=self.path_anlagenstammdaten,
+                                    file_name=self.checkpoint_name)
+
+    def _read_checkpoint(self) -> list:
+        try:
+            return read_file.json_to_dict(self.path_anlagenstammdaten,
+                                          self.checkpoint_name)["completed"]
+        except OSError:
+            return []
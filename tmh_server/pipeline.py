@@ -0,0 +1,420 @@
+"""Module combining extraction, cleaning, mapping, and storing of curtailments"""
+# stdlib
+import time
+import queue
+import logging
+import threading
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# third party
+import pandas as pd
+
+# relative
+from tmh_server.mapping import Mapping
+from tmh_server.avacon_api import BASE_URL, AvaconAPI, RateLimit
+from tmh_server.postgresql import PostgreSQL
+from tmh_server.process_data import ProcessData
+from tmh_server.schema import apply_schema
+
+# Marks the last batch put into a queue between pipeline stages
+END_OF_STREAM: object = object()
+# Seconds a blocked stage waits before checking for a failed stage
+POLL_INTERVAL: float = 0.1
+
+
+def sync_incremental(config_path: str,
+                     avacon_config_name: str,
+                     query_config_name: str,
+                     operator: str=None,
+                     mapper: Mapping=None,
+                     lookback: timedelta=timedelta(days=1)) -> pd.DataFrame:
+    """
+    Fetch, clean, and upsert only curtailments starting at most lookback
+    before the latest one already stored in the database (high-water
+    mark). Existing rows are kept, so readers never see an empty table.
+
+    The overlap catches curtailments which start at or before the
+    high-water mark but were published after the last sync. Rows fetched
+    again are merged by the natural key of upsert.
+
+    :param config_path: str, path of folder with config files
+    :param avacon_config_name: str, name of Avacon API config file
+    :param query_config_name: str, name of PostgreSQL config file
+    :param operator: str, | network operator as stored in the table to
+                          | read the high-water mark for. All operators
+                          | if None
+    :param mapper: Mapping, | maps nominal power and calculates curtailed
+                            | power and energy of new rows if given
+    :param lookback: timedelta, overlap fetched before the high-water mark
+    :return: pandas data frame, upserted rows
+    """
+    start: int = time.time()
+    psql: PostgreSQL = PostgreSQL(config_path=config_path,
+                                  config_name=query_config_name,
+                                  data=pd.DataFrame())
+    psql.connect_to_db()
+    try:
+        high_water_mark = psql.get_high_water_mark(operator)
+    finally:
+        psql.close_connection()
+
+    avacon_api: AvaconAPI = AvaconAPI(config_path=config_path,
+                                      config_name=avacon_config_name)
+    if high_water_mark is not None:
+        avacon_api.set_config_value("val1",
+                                    (high_water_mark - lookback).strftime("%Y-%m-%d %H:%M:%S"))
+        print(f"Incremental sync from {high_water_mark - lookback}")
+    try:
+        df: pd.DataFrame = avacon_api.call_api()
+    finally:
+        avacon_api.close()
+    if df.empty:
+        print("No new curtailments")
+        return df
+
+    process_data: ProcessData = ProcessData(df)
+    process_data.clean()
+    df = process_data.get_data()
+    if df.empty:
+        print("No new curtailments")
+        return df
+
+    if mapper is not None:
+        df = df.assign(power_nominal=0.0)
+        mapper.set_df(df)
+        mapper.get_merged_snbs()
+        mapper.create_mapping()
+        mapper.map_power_to_plant_id()
+        mapper.calculate_curtailed_power()
+        mapper.calculate_curtailed_energy()
+        df = mapper.df_db
+
+    psql.set_df(df)
+    psql.upsert()
+    logging.info("Upserted %s curtailments", df.shape[0])
+    print(f"Incremental sync of {df.shape[0]} rows took {time.time() - start}s")
+    return df
+
+
+def sync_streaming(config_path: str,
+                   avacon_config_name: str,
+                   query_config_name: str,
+                   mapper: Mapping=None,
+                   chunksize: int=10000) -> int:
+    """
+    Fetch, clean, map, and insert curtailments batch by batch. Each
+    batch flows from the Avacon API response straight into COPY, so peak
+    memory is bounded by the chunk size instead of the fetched window.
+
+    :param config_path: str, path of folder with config files
+    :param avacon_config_name: str, name of Avacon API config file
+    :param query_config_name: str, name of PostgreSQL config file
+    :param mapper: Mapping, | maps nominal power and calculates curtailed
+                            | power and energy if given
+    :param chunksize: int, maximum number of rows per batch
+    :return: int, number of inserted rows
+    """
+    avacon_api: AvaconAPI = AvaconAPI(config_path=config_path,
+                                      config_name=avacon_config_name)
+    batches = ProcessData().clean_batches(avacon_api.iter_batches(chunksize=chunksize))
+    if mapper is not None:
+        mapper.get_merged_snbs()
+        mapper.create_mapping()
+        batches = mapper.map_batches(batches)
+    psql: PostgreSQL = PostgreSQL(config_path=config_path,
+                                  config_name=query_config_name,
+                                  data=pd.DataFrame())
+    try:
+        return psql.insert_batches(batches, *avacon_api.get_window())
+    finally:
+        avacon_api.close()
+
+
+def run_overlapped(source,
+                   stages: list,
+                   sink,
+                   maxsize: int=2):
+    """
+    Run a source, transform stages, and a sink concurrently. The source
+    and every stage run in their own thread and hand data frame batches
+    on through bounded queues, the sink runs in the calling thread. A
+    full queue blocks the stage in front of it, so at most maxsize
+    batches wait between two stages and the wall time approaches the
+    one of the slowest stage.
+
+    If any stage fails, all other stages stop and the first error is
+    raised. The sink sees the error as well, so e.g. a COPY is rolled
+    back instead of committing a partial load.
+
+    :param source: iterable, pandas data frames, e.g. AvaconAPI.iter_batches
+    :param stages: list, | callables taking and returning an iterable of
+                         | batches, e.g. ProcessData.clean_batches
+    :param sink: callable, | consumes an iterable of batches, e.g.
+                           | PostgreSQL.insert_batches
+    :param maxsize: int, maximum number of batches per queue
+    :return: any, return value of the sink
+    """
+    start: int = time.time()
+    stop: threading.Event = threading.Event()
+    errors: list = []
+    queues: list = [queue.Queue(maxsize=maxsize) for _ in range(len(stages) + 1)]
+
+    def drain(batches: queue.Queue):
+        while True:
+            try:
+                batch = batches.get(timeout=POLL_INTERVAL)
+            except queue.Empty as e:
+                if stop.is_set():
+                    raise (errors[0] if errors else Exception("Pipeline stopped")) from e
+                continue
+            if batch is END_OF_STREAM:
+                return
+            yield batch
+
+    def put(batches: queue.Queue,
+            batch) -> bool:
+        while not stop.is_set():
+            try:
+                batches.put(batch, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def feed(batches,
+             out: queue.Queue) -> None:
+        try:
+            for batch in batches:
+                if not put(out, batch):
+                    return
+            put(out, END_OF_STREAM)
+        except Exception as e:  # pylint: disable=broad-except
+            if not stop.is_set():
+                logging.error("Pipeline stage failed: %s", e)
+                errors.append(e)
+            stop.set()
+
+    threads: list = [threading.Thread(target=feed, args=(source, queues[0]),
+                                      name="pipeline-source", daemon=True)]
+    for i, stage in enumerate(stages):
+        threads.append(threading.Thread(target=feed,
+                                        args=(stage(drain(queues[i])), queues[i + 1]),
+                                        name=f"pipeline-stage-{i}", daemon=True))
+    for thread in threads:
+        thread.start()
+    try:
+        result = sink(drain(queues[-1]))
+    except Exception:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    print(f"Overlapped pipeline took {time.time() - start}s")
+    return result
+
+
+def sync_overlapped(config_path: str,
+                    avacon_config_name: str,
+                    query_config_name: str,
+                    mapper: Mapping=None,
+                    chunksize: int=10000,
+                    maxsize: int=2) -> int:
+    """
+    Like sync_streaming, but downloading, cleaning, mapping, and COPY
+    run in separate threads linked by bounded queues, so network I/O,
+    pandas work, and the database overlap.
+
+    :param config_path: str, path of folder with config files
+    :param avacon_config_name: str, name of Avacon API config file
+    :param query_config_name: str, name of PostgreSQL config file
+    :param mapper: Mapping, | maps nominal power and calculates curtailed
+                            | power and energy if given
+    :param chunksize: int, maximum number of rows per batch
+    :param maxsize: int, maximum number of batches between two stages
+    :return: int, number of inserted rows
+    """
+    avacon_api: AvaconAPI = AvaconAPI(config_path=config_path,
+                                      config_name=avacon_config_name)
+    stages: list = [ProcessData().clean_batches]
+    if mapper is not None:
+        mapper.get_merged_snbs()
+        mapper.create_mapping()
+        stages.append(mapper.map_batches)
+    psql: PostgreSQL = PostgreSQL(config_path=config_path,
+                                  config_name=query_config_name,
+                                  data=pd.DataFrame())
+    try:
+        start, end = avacon_api.get_window()
+        return run_overlapped(avacon_api.iter_batches(chunksize=chunksize),
+                              stages,
+                              lambda batches: psql.insert_batches(batches, start, end),
+                              maxsize=maxsize)
+    finally:
+        avacon_api.close()
+
+
+def fetch_operator(config_path: str,
+                   avacon_config_name: str,
+                   operator: str,
+                   windows: list,
+                   min_interval: float=0.0,
+                   mapper: Mapping=None,
+                   base_url: str=BASE_URL) -> pd.DataFrame:
+    """
+    Fetch, clean, and map the curtailments of one network operator. The
+    windows are fetched one after another with one rate limit, so an
+    operator never sees more than one request per min_interval.
+
+    :param config_path: str, path of folder with config files
+    :param avacon_config_name: str, name of Avacon API config file
+    :param operator: str, networkoperator of the API, e.g. "ava"
+    :param windows: list, tuples of (val1, val2) of the API
+    :param min_interval: float, minimum seconds between two requests
+    :param mapper: Mapping, | maps nominal power and calculates curtailed
+                            | power and energy if given. The mapping has
+                            | to be created beforehand
+    :param base_url: str, URL of the export endpoint of the API
+    :return: pandas data frame, cleaned curtailments of the operator
+    """
+    rate_limit: RateLimit = RateLimit(min_interval)
+    frames: list = []
+    for val1, val2 in windows:
+        avacon_api: AvaconAPI = AvaconAPI(config_path=config_path,
+                                          config_name=avacon_config_name,
+                                          base_url=base_url,
+                                          rate_limit=rate_limit)
+        avacon_api.set_config_value("networkoperator", operator)
+        avacon_api.set_config_value("val1", val1)
+        avacon_api.set_config_value("val2", val2)
+        try:
+            frames.append(avacon_api.call_api())
+        finally:
+            avacon_api.close()
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame()
+
+    process_data: ProcessData = ProcessData(pd.concat(frames, ignore_index=True, sort=False))
+    process_data.clean()
+    df: pd.DataFrame = process_data.get_data()
+    if mapper is not None and not df.empty:
+        mapped: list = list(mapper.map_batches([df]))
+        df = mapped[0] if mapped else df.iloc[0:0]
+    return df
+
+
+def fetch_operators(config_path: str,
+                    avacon_config_name: str,
+                    operators: list,
+                    windows: list,
+                    mapper: Mapping=None,
+                    max_workers: int=4,
+                    min_interval=0.0,
+                    retries: int=1,
+                    base_url: str=BASE_URL) -> tuple:
+    """
+    Fetch, clean, and map the curtailments of several network operators
+    in a process pool, one task per operator. Failed operators are
+    retried on their own up to retries times, successful ones are kept.
+
+    :param config_path: str, path of folder with config files
+    :param avacon_config_name: str, name of Avacon API config file
+    :param operators: list, networkoperator values of the API
+    :param windows: list, tuples of (val1, val2) fetched per operator
+    :param mapper: Mapping, | maps nominal power and calculates curtailed
+                            | power and energy if given
+    :param max_workers: int, maximum number of concurrent operators
+    :param min_interval: float or dict, | minimum seconds between two
+                                        | requests, per operator if dict
+    :param retries: int, number of retries of failed operators
+    :param base_url: str, URL of the export endpoint of the API
+    :return: tuple, | merged pandas data frame of all successful
+                    | operators and dict of error messages of the
+                    | failed operators
+    """
+    start: int = time.time()
+    if mapper is not None:
+        mapper.get_merged_snbs()
+        mapper.create_mapping()
+    results: dict = {}
+    failed: dict = {}
+    pending: list = list(operators)
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        if attempt > 0:
+            print(f"Retrying operators {pending}")
+        failed = {}
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures: dict = {
+                executor.submit(fetch_operator, config_path, avacon_config_name, operator, windows,
+                                min_interval.get(operator, 0.0) if isinstance(min_interval, dict)
+                                else min_interval,
+                                mapper, base_url): operator
+                for operator in pending}
+            for future in as_completed(futures):
+                operator: str = futures[future]
+                try:
+                    results[operator] = future.result()
+                except Exception as e:  # pylint: disable=broad-except
+                    logging.error("Operator %s failed: %s", operator, e)
+                    failed[operator] = str(e)
+        pending = list(failed)
+
+    frames: list = [results[o] for o in operators if o in results and not results[o].empty]
+    df: pd.DataFrame = apply_schema(pd.concat(frames, ignore_index=True, sort=False)) \
+        if frames else pd.DataFrame()
+    print(f"Fetching {len(results)} of {len(operators)} operators took {time.time() - start}s")
+    return df, failed
+
+
+def sync_operators(config_path: str,
+                   avacon_config_name: str,
+                   query_config_name: str,
+                   operators: list,
+                   windows: list,
+                   mapper: Mapping=None,
+                   max_workers: int=4,
+                   min_interval=0.0,
+                   retries: int=1,
+                   upsert: bool=True) -> dict:
+    """
+    Fetch several network operators with fetch_operators and store the
+    merged curtailments of all successful operators with one load. As
+    an upsert is idempotent, failed operators can be synced again on
+    their own, e.g. with operators=list(failed).
+
+    :param config_path: str, path of folder with config files
+    :param avacon_config_name: str, name of Avacon API config file
+    :param query_config_name: str, name of PostgreSQL config file
+    :param operators: list, networkoperator values of the API
+    :param windows: list, tuples of (val1, val2) fetched per operator
+    :param mapper: Mapping, | maps nominal power and calculates curtailed
+                            | power and energy if given
+    :param max_workers: int, maximum number of concurrent operators
+    :param min_interval: float or dict, | minimum seconds between two
+                                        | requests, per operator if dict
+    :param retries: int, number of retries of failed operators
+    :param upsert: bool, merge into the table instead of appending
+    :return: dict, error messages of the failed operators
+    """
+    df, failed = fetch_operators(config_path, avacon_config_name, operators, windows,
+                                 mapper=mapper, max_workers=max_workers,
+                                 min_interval=min_interval, retries=retries)
+    if df.empty:
+        print("No new curtailments")
+        return failed
+    psql: PostgreSQL = PostgreSQL(config_path=config_path,
+                                  config_name=query_config_name,
+                                  data=df)
+    if upsert:
+        psql.upsert()
+    else:
+        psql.connect_and_insert()
+    logging.info("Stored %s curtailments of %s operators", df.shape[0],
+                 len(operators) - len(failed))
+    return failed
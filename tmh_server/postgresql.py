@@ -3,13 +3,34 @@
 import sys
 import time
 import logging
-from io import StringIO
+import threading
+from datetime import timedelta
+from contextlib import contextmanager
 
 # third party
 import psycopg2
 import pandas as pd
 from psycopg2 import sql
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extensions import make_dsn
 from tmh_server import read_file
+from tmh_server.copy_stream import CopyStream, csv_batches, binary_batches
+from tmh_server.schema import CREATE_CURTAILMENTS, CREATE_PARTITIONED_CURTAILMENTS, \
+    CREATE_ROLLUP, ROLLUP_GRAINS
+
+# Connection pools shared by all instances, keyed by connection string
+POOLS: dict = {}
+POOLS_LOCK: threading.Lock = threading.Lock()
+
+
+def close_pools() -> None:
+    """
+    Close all pooled connections of all PostgreSQL instances.
+    """
+    with POOLS_LOCK:
+        for pool in POOLS.values():
+            pool.closeall()
+        POOLS.clear()
 
 
 class PostgreSQL:
@@ -20,13 +41,36 @@ class PostgreSQL:
     Default port = 5432.
     Run SELECT * FROM pg_settings WHERE name = 'port'; in command line to
     see the specified port.
+
+    Data frames are written with COPY in chunks of chunksize rows, either
+    as quoted CSV or in PostgreSQL's binary format (copy_format="binary").
+
+    Connections are taken from a ThreadedConnectionPool shared by all
+    instances with the same connection parameters. Up to minconn idle
+    connections are kept warm, at most maxconn are open at once. Host
+    and port are read from the optional config keys "host" and "port".
+
+    The table of the config may be partitioned by month of
+    start_curtailment (create_partitioned_table). Missing partitions
+    are then created before connect_and_insert and upsert load a data
+    frame, and swap_partition replaces a whole month at once.
+
+    If rollup tables exist (create_rollups), every load refreshes the
+    hourly, daily, and monthly buckets of its time range in the same
+    transaction.
     """
 
     def __init__(self,
                  config_path: str,
                  config_name: str,
-                 data: pd.DataFrame):
+                 data: pd.DataFrame,
+                 copy_format: str="csv",
+                 chunksize: int=100000,
+                 minconn: int=2,
+                 maxconn: int=10):
         self.df: pd.DataFrame = data
+        self.copy_format: str = copy_format
+        self.chunksize: int = chunksize
 
         # Config variables
         self.config_path: str = config_path
@@ -35,6 +79,9 @@ class PostgreSQL:
         self.config_keys: list = ["user", "password",
                                   "db_name", "table_name"]
 
+        self.minconn: int = minconn
+        self.maxconn: int = maxconn
+        self.pool: ThreadedConnectionPool = None
         self.connection = None
         self.cur = None
 
@@ -48,51 +95,533 @@ class PostgreSQL:
 
     def connect_and_insert(self):
         """
-        Insert data based on config file into an existing table.
+        Insert data based on config file into an existing table. The
+        COPY, missing partitions, and the rollup refresh are committed
+        together or rolled back together.
         """
-        self.connect_to_db()
-        if self.config["table_name"] in self._get_tables():
+        with self.transaction():
+            if self.config["table_name"] not in self._get_tables():
+                raise Exception("Insertion pipeline failed")
             self._add_missing_columns_to_df()
+            self._ensure_partitions_for_df()
             self._insert_in_table_copy()
-            self.close_connection()
-        else:
-            raise Exception("Insertion pipeline failed")
+            self._refresh_rollups_for_df()
+
+    def insert_batches(self,
+                       batches,
+                       start=None,
+                       end=None) -> int:
+        """
+        Insert data frame batches, e.g. from AvaconAPI.iter_batches or
+        iter_rows, into the table of the config with a single COPY in one
+        transaction. Only one batch is held in memory at a time. As the
+        batches are not known in advance, the missing partitions of a
+        partitioned table are created for start to end before the COPY.
+
+        :param batches: iterable, pandas data frames
+        :param start: datetime or str, | earliest start_curtailment of the
+                                       | batches, e.g. from AvaconAPI.get_window
+        :param end: datetime or str, latest start_curtailment of the batches
+        :return: int, number of inserted rows
+        """
+        start_time: int = time.time()
+        rows: list = [0]
+        bounds: list = []
+
+        def complete_batches(columns: list):
+            for df in batches:
+                rows[0] += df.shape[0]
+                if "start_curtailment" in df.columns and not df.empty:
+                    bounds.extend([df["start_curtailment"].min(), df["start_curtailment"].max()])
+                yield df.assign(**{c: 0 for c in columns if c not in df.columns})
+
+        with self.transaction():
+            if self.config["table_name"] not in self._get_tables():
+                raise Exception("Insertion pipeline failed")
+            columns: list = self._get_table_columns()
+            if start is not None and end is not None:
+                self._ensure_partitions(start, end)
+            self._copy_batches(complete_batches(columns), self.config["table_name"], columns)
+            if bounds:
+                self._refresh_rollups(min(bounds), max(bounds))
+        duration: float = time.time() - start_time
+        print(f"Storing {rows[0]} rows into database took {duration}s "
+              f"({rows[0] / max(duration, 1e-9):.0f} rows/s)")
+        return rows[0]
+
+    def upsert(self,
+               key_columns: list=None) -> None:
+        """
+        Merge data into the table of the config. The data frame is copied
+        into a temporary staging table and merged with a single
+        INSERT ... ON CONFLICT DO UPDATE in one transaction, so clients
+        never read a half-empty table. The table requires a unique
+        constraint on the key columns.
+
+        Existing rows are only updated in the columns of the data frame,
+        so e.g. cleaned but unmapped rows keep their curtailed power.
+        Table columns missing in the data frame are set to 0 in new rows.
+
+        :param key_columns: list, | natural key of a row, defaults to
+                                  | start_curtailment and plant_id
+        """
+        start: int = time.time()
+        key_columns: list = key_columns or ["start_curtailment", "plant_id"]
+        with self.transaction():
+            if self.config["table_name"] not in self._get_tables():
+                raise Exception("Upsert pipeline failed")
+            columns: list = self._get_table_columns()
+            update_columns: list = [c for c in columns
+                                    if c in self.df.columns and c not in key_columns]
+            self._add_missing_columns_to_df()
+            df: pd.DataFrame = self.df[columns].drop_duplicates(subset=key_columns,
+                                                                keep="last")
+            staging: str = f"{self.config['table_name']}_staging"
+            conflict: sql.Composable = sql.SQL("DO UPDATE SET {updates}").format(
+                updates=sql.SQL(",").join(
+                    sql.SQL("{col} = EXCLUDED.{col}").format(col=sql.Identifier(c))
+                    for c in update_columns)) if update_columns else sql.SQL("DO NOTHING")
+            self._ensure_partitions_for_df()
+            self.cur.execute(sql.SQL(
+                "CREATE TEMPORARY TABLE {staging} (LIKE {table} INCLUDING DEFAULTS) "
+                "ON COMMIT DROP").format(staging=sql.Identifier(staging),
+                                         table=sql.Identifier(self.config["table_name"])))
+            self._copy_expert(df, staging, columns)
+            self.cur.execute(sql.SQL(
+                "INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging} "
+                "ON CONFLICT ({keys}) {conflict}").format(
+                table=sql.Identifier(self.config["table_name"]),
+                columns=sql.SQL(",").join(map(sql.Identifier, columns)),
+                staging=sql.Identifier(staging),
+                keys=sql.SQL(",").join(map(sql.Identifier, key_columns)),
+                conflict=conflict))
+            self._refresh_rollups_for_df()
+        print(f"Upserting {df.shape[0]} rows took {time.time() - start}s")
+
+    def create_table(self) -> None:
+        """
+        Create the table of the config with the columns of the
+        curtailment schema and the natural key of upsert.
+        """
+        table: str = self.config["table_name"]
+        with self.transaction():
+            self.cur.execute(sql.SQL(CREATE_CURTAILMENTS).format(
+                table=sql.Identifier(table),
+                key=sql.Identifier(f"{table}_natural_key")))
+
+    def create_partitioned_table(self) -> None:
+        """
+        Create the table of the config partitioned by month of
+        start_curtailment, with the natural key of upsert and the indexes
+        of create_indexes. Monthly partitions are added by
+        ensure_partitions.
+        """
+        table: str = self.config["table_name"]
+        with self.transaction():
+            self.cur.execute(sql.SQL(CREATE_PARTITIONED_CURTAILMENTS).format(
+                table=sql.Identifier(table),
+                key=sql.Identifier(f"{table}_natural_key")))
+            self._create_indexes(table)
+
+    def create_indexes(self) -> None:
+        """
+        Create a BRIN index on start_curtailment for time range queries
+        and a B-tree index on plant_id for per-plant lookups and updates.
+        On a partitioned table the indexes are created on every partition.
+        """
+        with self.transaction():
+            self._create_indexes(self.config["table_name"])
+
+    def ensure_partitions(self,
+                          start,
+                          end) -> list:
+        """
+        Create the missing monthly partitions of the table of the config
+        between start and end, e.g. curtailments_y2022m01.
+
+        :param start: datetime or str, first timestamp to cover
+        :param end: datetime or str, last timestamp to cover
+        :return: list, names of all partitions between start and end
+        """
+        with self.transaction():
+            partitions: list = self._ensure_partitions(start, end)
+        return partitions
+
+    def swap_partition(self,
+                       df: pd.DataFrame,
+                       month) -> None:
+        """
+        Replace the partition of a month with the rows of a data frame.
+        The rows are copied into a new table, which is checked against
+        the bounds of the month, so that ATTACH does not scan it again.
+        The old partition is detached and dropped and the new one
+        attached in the same transaction, so readers see either the old
+        or the new month, never a partial one.
+
+        :param df: pandas data frame, all curtailments of the month
+        :param month: datetime or str, any timestamp of the month
+        """
+        start: int = time.time()
+        table: str = self.config["table_name"]
+        lower, upper = self._partition_bounds(month, month)[0]
+        partition: str = self._partition_name(table, lower)
+        new_partition: str = f"{partition}_new"
+        with self.transaction():
+            columns: list = self._get_table_columns()
+            self.cur.execute(sql.SQL("DROP TABLE IF EXISTS {new}").format(
+                new=sql.Identifier(new_partition)))
+            self.cur.execute(sql.SQL(
+                "CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS INCLUDING INDEXES)").format(
+                new=sql.Identifier(new_partition), table=sql.Identifier(table)))
+            self.cur.execute(sql.SQL(
+                "ALTER TABLE {new} ADD CONSTRAINT {check} CHECK (start_curtailment IS NOT NULL "
+                "AND start_curtailment >= %s AND start_curtailment < %s)").format(
+                new=sql.Identifier(new_partition),
+                check=sql.Identifier(f"{partition}_bounds")), (lower, upper))
+            self._copy_expert(df.assign(**{c: 0 for c in columns if c not in df.columns}),
+                              new_partition, columns)
+            if partition in self._get_tables():
+                self.cur.execute(sql.SQL("ALTER TABLE {table} DETACH PARTITION {partition}").format(
+                    table=sql.Identifier(table), partition=sql.Identifier(partition)))
+                self.cur.execute(sql.SQL("DROP TABLE {partition}").format(
+                    partition=sql.Identifier(partition)))
+            self.cur.execute(sql.SQL("ALTER TABLE {new} RENAME TO {partition}").format(
+                new=sql.Identifier(new_partition), partition=sql.Identifier(partition)))
+            self.cur.execute(sql.SQL("ALTER TABLE {table} ATTACH PARTITION {partition} "
+                                     "FOR VALUES FROM (%s) TO (%s)").format(
+                table=sql.Identifier(table), partition=sql.Identifier(partition)), (lower, upper))
+            self._refresh_rollups(lower, upper - timedelta(microseconds=1))
+        print(f"Swapping {df.shape[0]} rows into {partition} took {time.time() - start}s")
+
+    def create_rollups(self) -> None:
+        """
+        Create the rollup tables of the table of the config, e.g.
+        curtailments_by_hour, curtailments_by_day, and
+        curtailments_by_month, and fill them from all stored rows. They
+        hold the number, total duration, total curtailed energy, and
+        maximum curtailed power per time bucket, plant, operator, and
+        cause, so clients do not have to aggregate the raw rows.
+        """
+        table: str = self.config["table_name"]
+        with self.transaction():
+            for grain in ROLLUP_GRAINS:
+                rollup: str = self._rollup_name(table, grain)
+                self.cur.execute(sql.SQL(CREATE_ROLLUP).format(table=sql.Identifier(rollup)))
+                self.cur.execute(sql.SQL(
+                    "CREATE INDEX IF NOT EXISTS {index} ON {rollup} (bucket)").format(
+                    index=sql.Identifier(f"{rollup}_bucket_idx"), rollup=sql.Identifier(rollup)))
+                self.cur.execute(sql.SQL(
+                    "CREATE INDEX IF NOT EXISTS {index} ON {rollup} (operator, bucket)").format(
+                    index=sql.Identifier(f"{rollup}_operator_idx"), rollup=sql.Identifier(rollup)))
+            self._refresh_rollups()
+
+    def refresh_rollups(self,
+                        start=None,
+                        end=None) -> None:
+        """
+        Recompute the rollup buckets between start and end, e.g. after
+        rows were changed outside of this class.
+
+        :param start: datetime or str, | first timestamp to refresh,
+                                       | earliest stored row if None
+        :param end: datetime or str, | last timestamp to refresh, latest
+                                     | stored row if None
+        """
+        with self.transaction():
+            self._refresh_rollups(start, end)
+
+    def load_plant_power(self,
+                         df: pd.DataFrame,
+                         table_name: str="plant_power") -> None:
+        """
+        Replace the mapping of power plant ID to nominal power in the
+        database, e.g. with Mapping.get_plant_power(). The table is
+        created with plant_id as primary key if it does not exist.
+
+        :param df: pandas data frame, columns plant_id and power_nominal
+        :param table_name: str, name of mapping table
+        """
+        start: int = time.time()
+        with self.transaction():
+            self.cur.execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {table} "
+                "(plant_id VARCHAR PRIMARY KEY, power_nominal REAL)").format(
+                table=sql.Identifier(table_name)))
+            self.cur.execute(sql.SQL("TRUNCATE {table}").format(table=sql.Identifier(table_name)))
+            self._copy_expert(df, table_name, ["plant_id", "power_nominal"])
+        print(f"Loading {df.shape[0]} plants took {time.time() - start}s")
+
+    def update_curtailed_power(self,
+                               table_name: str="plant_power",
+                               delete_unmatched: bool=False) -> None:
+        """
+        Set nominal power, curtailed power in kW, and curtailed energy in
+        kWh of all curtailments with a single set-based UPDATE joining the
+        mapping table. Only rows whose nominal power, curtailed power, or
+        curtailed energy change are written, e.g. also rows with a new
+        level or duration. The rollups are refreshed between the first
+        and last start_curtailment of the changed rows.
+
+        :param table_name: str, name of mapping table
+        :param delete_unmatched: bool, | delete curtailments of power
+                                       | plants missing in the mapping
+                                       | table like Mapping does
+        """
+        start: int = time.time()
+        with self.transaction():
+            power: str = "(p.power_nominal * (100 - c.level) / 100)::REAL"
+            energy: str = "(p.power_nominal * (100 - c.level) / 100 * c.duration / 60)::REAL"
+            # Count and time range of the changed rows
+            changed: str = "SELECT count(*), min(start_curtailment), max(start_curtailment) " \
+                "FROM changed"
+            self.cur.execute(sql.SQL(
+                "WITH changed AS (UPDATE {table} AS c SET power_nominal = p.power_nominal, "
+                f"power_curtailed = {power}, energy_curtailed = {energy} "
+                "FROM {mapping} AS p WHERE c.plant_id = p.plant_id "
+                "AND (c.power_nominal, c.power_curtailed, c.energy_curtailed) "
+                f"IS DISTINCT FROM (p.power_nominal, {power}, {energy}) "
+                f"RETURNING c.start_curtailment) {changed}").format(
+                table=sql.Identifier(self.config["table_name"]),
+                mapping=sql.Identifier(table_name)))
+            updated, first, last = self.cur.fetchone()
+            bounds: list = [first, last]
+            if delete_unmatched:
+                self.cur.execute(sql.SQL(
+                    "WITH changed AS (DELETE FROM {table} AS c WHERE NOT EXISTS "
+                    "(SELECT 1 FROM {mapping} AS p WHERE p.plant_id = c.plant_id) "
+                    f"RETURNING c.start_curtailment) {changed}").format(
+                    table=sql.Identifier(self.config["table_name"]),
+                    mapping=sql.Identifier(table_name)))
+                bounds.extend(self.cur.fetchone()[1:])
+            bounds = [b for b in bounds if b is not None]
+            if bounds:
+                self._refresh_rollups(min(bounds), max(bounds))
+        print(f"Updating {updated} curtailments took {time.time() - start}s")
 
     def _validate_config(self) -> bool:
-        self.config: dict = read_file.json_to_dict(self.config_path,
-                                                   self.config_name)
+        if not self.config:
+            self.config: dict = read_file.json_to_dict(self.config_path,
+                                                       self.config_name)
         if all(e in list(self.config.keys()) for e in self.config_keys):
             return True
         return False
 
     def connect_to_db(self,
-                      host: str="localhost",
-                      port: int=5432):
+                      host: str=None,
+                      port: int=None):
         """
-        Connects to a PostgreSQL database if a db_name is given.
+        Takes a connection to a PostgreSQL database from the pool if a
+        db_name is given.
+
+        :param host; str, | IP address of PostgreSQL server, defaults to
+                          | config key "host" or localhost
+        :param port: int, | port of PostgreSQL server, defaults to config
+                          | key "port" or 5432
+        """
+        try:
+            self.connection = self._get_pool(host, port).getconn()
+            self.cur = self.connection.cursor()
+        except psycopg2.OperationalError as e:
+            logging.error(e)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Context manager running a transaction on a pooled connection,
+        used by all methods writing to the database. Commits if the block
+        succeeds, rolls back otherwise, and returns the connection to the
+        pool in both cases.
+
+        with psql.transaction() as cur:
+            cur.execute(...)
+
+        :return: cursor, cursor of the pooled connection
+        """
+        self.connect_to_db()
+        try:
+            yield self.cur
+            self.connection.commit()
+        except psycopg2.DatabaseError as e:
+            logging.error("%s", e)
+            self.connection.rollback()
+            raise
+        except Exception:
+            if self.connection is not None:
+                self.connection.rollback()
+            raise
+        finally:
+            self.close_connection()
+
+    def _get_pool(self,
+                  host: str=None,
+                  port: int=None) -> ThreadedConnectionPool:
+        """
+        Get the connection pool for the parameters of the config and
+        create it on first use.
 
         :param host; str, IP address of PostgreSQL server
         :param port: int, port of PostgreSQL server
-        :param user: str, PostgreSQL user name
-        :param password: str, password for user
-        :param db_name: str, database name
+        :return: ThreadedConnectionPool, shared connection pool
         """
-        try:
-            if self._validate_config():
-                conn_string = "host=" + host + \
-                            " port=" + str(port) + \
-                            " user=" + self.config["user"] + \
-                            " password=" + self.config["password"]
-                if self.config["db_name"] is not None:
-                    conn_string += " dbname=" + self.config["db_name"]
-
-                self.connection = psycopg2.connect(conn_string)
-                self.cur = self.connection.cursor()
+        if not self._validate_config():
+            logging.error("Config %s misses one of %s", self.config_name, self.config_keys)
+            raise Exception(f"Config {self.config_name} misses one of {self.config_keys}")
+        dsn: str = make_dsn(host=host or self.config.get("host", "localhost"),
+                            port=port or self.config.get("port", 5432),
+                            user=self.config["user"],
+                            password=self.config["password"],
+                            dbname=self.config["db_name"])
+        with POOLS_LOCK:
+            if dsn not in POOLS:
+                POOLS[dsn] = ThreadedConnectionPool(self.minconn, self.maxconn, dsn)
+            self.pool = POOLS[dsn]
+        return self.pool
+
+    def _create_indexes(self,
+                        table_name: str) -> None:
+        self.cur.execute(sql.SQL(
+            "CREATE INDEX IF NOT EXISTS {index} ON {table} USING brin (start_curtailment)").format(
+            index=sql.Identifier(f"{table_name}_start_brin"), table=sql.Identifier(table_name)))
+        self.cur.execute(sql.SQL(
+            "CREATE INDEX IF NOT EXISTS {index} ON {table} (plant_id)").format(
+            index=sql.Identifier(f"{table_name}_plant_id_idx"), table=sql.Identifier(table_name)))
+
+    def _is_partitioned(self,
+                        table_name: str) -> bool:
+        self.cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+                         "WHERE partrelid = to_regclass(%s))", (table_name,))
+        return self.cur.fetchone()[0]
+
+    def _ensure_partitions(self,
+                           start,
+                           end) -> list:
+        """
+        Create the missing monthly partitions between start and end
+        without committing. Tables which are not partitioned are left
+        untouched.
+
+        :param start: datetime or str, first timestamp to cover
+        :param end: datetime or str, last timestamp to cover
+        :return: list, names of all partitions between start and end
+        """
+        table: str = self.config["table_name"]
+        if not self._is_partitioned(table):
+            return []
+        partitions: list = []
+        for lower, upper in self._partition_bounds(start, end):
+            partition: str = self._partition_name(table, lower)
+            self.cur.execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table} "
+                "FOR VALUES FROM (%s) TO (%s)").format(
+                partition=sql.Identifier(partition), table=sql.Identifier(table)), (lower, upper))
+            partitions.append(partition)
+        return partitions
+
+    def _ensure_partitions_for_df(self) -> list:
+        if "start_curtailment" not in self.df.columns or self.df.empty:
+            return []
+        return self._ensure_partitions(self.df["start_curtailment"].min(),
+                                       self.df["start_curtailment"].max())
+
+    @staticmethod
+    def _partition_bounds(start,
+                          end) -> list:
+        """
+        Get the bounds of all months between start and end.
+
+        :param start: datetime or str, first timestamp to cover
+        :param end: datetime or str, last timestamp to cover
+        :return: list, tuples of (first day, first day of next month)
+        """
+        first: pd.Timestamp = pd.Timestamp(start).to_period("M").to_timestamp()
+        return [(m.to_pydatetime(), (m + pd.offsets.MonthBegin()).to_pydatetime())
+                for m in pd.date_range(first, pd.Timestamp(end), freq="MS")]
+
+    @staticmethod
+    def _partition_name(table_name: str,
+                        month) -> str:
+        return f"{table_name}_y{month.year}m{month.month:02d}"
+
+    def _refresh_rollups(self,
+                         start=None,
+                         end=None) -> None:
+        """
+        Replace the rollup buckets touching start to end without
+        committing. The hourly buckets are aggregated from the raw rows,
+        the daily ones from the hourly, and the monthly ones from the
+        daily buckets. Nothing is done if there are no rollup tables.
+
+        :param start: datetime or str, first timestamp to refresh
+        :param end: datetime or str, last timestamp to refresh
+        """
+        start_time: int = time.time()
+        table: str = self.config["table_name"]
+        if self._rollup_name(table, next(iter(ROLLUP_GRAINS))) not in self._get_tables():
+            return
+        if start is None or end is None:
+            self.cur.execute(sql.SQL(
+                "SELECT min(start_curtailment), max(start_curtailment) FROM {table}").format(
+                table=sql.Identifier(table)))
+            first, last = self.cur.fetchone()
+            if first is None:
+                return
+            start = first if start is None else start
+            end = last if end is None else end
+
+        source: str = table
+        for grain in ROLLUP_GRAINS:
+            rollup: str = self._rollup_name(table, grain)
+            lower, upper = self._bucket_bounds(start, end, grain)
+            self.cur.execute(sql.SQL("DELETE FROM {rollup} "
+                                     "WHERE bucket >= %s AND bucket < %s").format(
+                rollup=sql.Identifier(rollup)), (lower, upper))
+            if source == table:
+                query: sql.SQL = sql.SQL(
+                    "INSERT INTO {rollup} SELECT date_trunc(%s, start_curtailment), "
+                    "plant_id, operator, cause, count(*), sum(duration), "
+                    "sum(energy_curtailed), max(power_curtailed) FROM {source} "
+                    "WHERE start_curtailment >= %s AND start_curtailment < %s "
+                    "GROUP BY 1, 2, 3, 4")
             else:
-                raise Exception()
+                query: sql.SQL = sql.SQL(
+                    "INSERT INTO {rollup} SELECT date_trunc(%s, bucket), "
+                    "plant_id, operator, cause, sum(curtailments), sum(duration), "
+                    "sum(energy_curtailed), max(power_curtailed_max) FROM {source} "
+                    "WHERE bucket >= %s AND bucket < %s "
+                    "GROUP BY 1, 2, 3, 4")
+            self.cur.execute(query.format(rollup=sql.Identifier(rollup),
+                                          source=sql.Identifier(source)),
+                             (grain, lower, upper))
+            source = rollup
+        logging.info("Refreshing rollups from %s to %s took %ss", start, end,
+                     time.time() - start_time)
 
-        except psycopg2.OperationalError as e:
-            logging.error(e)
+    def _refresh_rollups_for_df(self) -> None:
+        if "start_curtailment" not in self.df.columns or self.df.empty:
+            return
+        self._refresh_rollups(self.df["start_curtailment"].min(),
+                              self.df["start_curtailment"].max())
+
+    @staticmethod
+    def _rollup_name(table_name: str,
+                     grain: str) -> str:
+        return f"{table_name}_by_{grain}"
+
+    @staticmethod
+    def _bucket_bounds(start,
+                       end,
+                       grain: str) -> tuple:
+        """
+        Get the bounds of all buckets of a grain touching start to end.
+
+        :param start: datetime or str, first timestamp to cover
+        :param end: datetime or str, last timestamp to cover
+        :param grain: str, key of ROLLUP_GRAINS
+        :return: tuple, first bucket and first bucket after end
+        """
+        freq: str = ROLLUP_GRAINS[grain]
+        return (pd.Timestamp(start).to_period(freq).start_time.to_pydatetime(),
+                (pd.Timestamp(end).to_period(freq) + 1).start_time.to_pydatetime())
 
     def _add_missing_columns_to_df(self):
         cols_in_table: list = self._get_table_columns()
@@ -146,6 +675,74 @@ class PostgreSQL:
                                              con=self.connection)
         return df
 
+    def iter_rows(self,
+                  table_name: str,
+                  columns: list=None,
+                  start=None,
+                  end=None,
+                  time_column: str="start_curtailment",
+                  chunksize: int=None):
+        """
+        Stream data from an existing table with a server-side (named)
+        cursor. Only chunksize rows are held in memory at once, so tables
+        larger than the available memory can be processed.
+
+        :param table_name: str, name of table in PostgreSQL database
+        :param columns: list, columns to select, all columns if None
+        :param start: datetime or str, | select rows with time_column >= start
+        :param end: datetime or str, | select rows with time_column < end
+        :param time_column: str, column start and end refer to
+        :param chunksize: int, | rows per data frame, defaults to
+                               | self.chunksize
+        :return: generator, pandas data frames
+        """
+        chunksize: int = chunksize or self.chunksize
+        query = sql.SQL("SELECT {columns} FROM {table}").format(
+            columns=sql.SQL(",").join(map(sql.Identifier, columns)) if columns else sql.SQL("*"),
+            table=sql.Identifier(table_name))
+        conditions: list = []
+        params: list = []
+        if start is not None:
+            conditions.append(sql.SQL("{col} >= %s").format(col=sql.Identifier(time_column)))
+            params.append(start)
+        if end is not None:
+            conditions.append(sql.SQL("{col} < %s").format(col=sql.Identifier(time_column)))
+            params.append(end)
+        if conditions:
+            query = sql.SQL("{query} WHERE {conditions}").format(
+                query=query, conditions=sql.SQL(" AND ").join(conditions))
+
+        cursor = self.connection.cursor(name=f"iter_{table_name}_{id(query)}")
+        cursor.itersize = chunksize
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows: list = cursor.fetchmany(chunksize)
+                if not rows:
+                    break
+                yield pd.DataFrame(rows, columns=[desc[0] for desc in cursor.description])
+        finally:
+            cursor.close()
+
+    def get_high_water_mark(self,
+                            operator: str=None):
+        """
+        Get the start of the latest curtailment stored in the table of
+        the config, optionally restricted to a single network operator.
+
+        :param operator: str, network operator as stored in the table
+        :return: datetime or None, latest start_curtailment
+        """
+        query = sql.SQL("SELECT max(start_curtailment) FROM {table}").format(
+            table=sql.Identifier(self.config["table_name"])
+        )
+        if operator is not None:
+            query = sql.SQL("{query} WHERE operator = %s").format(query=query)
+            self.cur.execute(query, (operator,))
+        else:
+            self.cur.execute(query)
+        return self.cur.fetchone()[0]
+
     # Manipulate connected PostgreSQL
     # ------------------------------------------------------------------
     def _create_table(self,
@@ -187,25 +784,84 @@ class PostgreSQL:
             sys.exit()
 
     def _insert_in_table_copy(self) -> None:
+        """
+        Copy the data frame into the table of the config without
+        committing.
+        """
         start: int = time.time()
-        buffer = StringIO()
-        buffer.write(self.df.to_csv(index=False, header=False, sep=";"))
-        buffer.seek(0)
+        self._copy_expert(self.df,
+                          self.config["table_name"],
+                          self._get_table_columns())
+        duration: float = time.time() - start
+        print(f"Storing {self.df.shape[0]} rows into database took {duration}s "
+              f"({self.df.shape[0] / max(duration, 1e-9):.0f} rows/s)")
 
-        try:
-            self.cur.copy_from(buffer,
-                               self.config["table_name"],
-                               sep=";")
-            self.connection.commit()
-            print(f"Storing into database took {time.time() - start}s")
-        except psycopg2.DatabaseError as e:
-            print(e)
-            self.connection.rollback()
-            self.connection.close()
+    def _copy_expert(self,
+                     df: pd.DataFrame,
+                     table_name: str,
+                     columns: list) -> None:
+        """
+        Stream a data frame into a table with COPY without committing.
+        Rows are serialized in chunks of self.chunksize rows, so memory
+        stays bounded by the chunk size instead of the frame size.
+
+        :param df: pandas data frame, data to copy
+        :param table_name: str, name of target table
+        :param columns: list, table columns to copy from the data frame
+        """
+        self._copy_batches([df], table_name, columns)
+
+    def _copy_batches(self,
+                      batches,
+                      table_name: str,
+                      columns: list) -> None:
+        """
+        Stream data frame batches into a table with a single COPY
+        without committing. Batches are consumed lazily while COPY reads.
+
+        :param batches: iterable, pandas data frames
+        :param table_name: str, name of target table
+        :param columns: list, table columns to copy from the data frames
+        """
+        if self.copy_format == "binary":
+            chunks = binary_batches(batches, columns,
+                                    self._get_column_type_oids(table_name, columns),
+                                    self.chunksize)
+            options: sql.SQL = sql.SQL("(FORMAT binary)")
+        elif self.copy_format == "csv":
+            chunks = csv_batches(batches, columns, self.chunksize)
+            options: sql.SQL = sql.SQL("(FORMAT csv)")
+        else:
+            logging.error("%s not in %s", self.copy_format, ["csv", "binary"])
+            raise Exception(f"{self.copy_format} not in {['csv', 'binary']}")
+        self.cur.copy_expert(sql.SQL("COPY {table} ({columns}) FROM STDIN WITH {options}").format(
+            table=sql.Identifier(table_name),
+            columns=sql.SQL(",").join(map(sql.Identifier, columns)),
+            options=options), CopyStream(chunks))
+
+    def _get_column_type_oids(self,
+                              table_name: str,
+                              columns: list) -> list:
+        """
+
+        :param table_name: str, name of table
+        :param columns: list, column names of table
+        :return: list, PostgreSQL type OIDs of the columns
+        """
+        self.cur.execute(sql.SQL("SELECT {columns} FROM {table} LIMIT 0").format(
+            columns=sql.SQL(",").join(map(sql.Identifier, columns)),
+            table=sql.Identifier(table_name)))
+        return [desc[1] for desc in self.cur.description]
 
     def close_connection(self):
         """
-        Terminates an existing PostgreSQL connection.
+        Returns an existing PostgreSQL connection to the pool.
         """
-        self.connection.close()
+        if self.connection is None:
+            return
+        if not self.cur.closed:
+            self.cur.close()
+        self.pool.putconn(self.connection)
+        self.connection = None
+        self.cur = None
     
\ No newline at end of file
@@ -7,33 +7,74 @@ from typing import Union
 # third party
 import pandas as pd
 
+# relative
+from tmh_server.schema import CURTAILMENT_DTYPES, apply_schema, check_int_range
+
+
+# Columns of the Avacon API to keep and their new names
+COLUMNS: dict = {"Start": "start_curtailment",
+                 "Ende": "end_curtailment",
+                 "Dauer (Min)": "duration",
+                 "Stufe (%)": "level",
+                 "Ursache": "cause",
+                 "Anlagenschlüssel": "plant_id",
+                 "Netzbetreiber": "operator"}
+VALID_LEVELS: list = [0, 30, 60]
+INVALID_CAUSES: list = ["Test"]
+INVALID_PLANT_IDS: list = ["Siehe Veröffentl. Netzbetreiber!"]
+
 
 class ProcessData:
     """
     Functions to clean and pre-process a given
     pandas dataframe for further usage.
+
+    Cleaning combines all row filters into one boolean mask and selects
+    and renames the remaining rows and columns in a single step, so the
+    frame is copied once. The duration of each step is stored in timings.
     """
     def __init__(self,
-                 df: pd.DataFrame) -> None:
+                 df: pd.DataFrame=None) -> None:
         self.df: pd.DataFrame = df
+        self.timings: dict = {}
+        self.seen_ids: set = set()
 
     def clean(self):
         """
         Summary of internal functions to pre-process a pandas dataframe
         """
         start: int = time.time()
-        self._remove_duplicates(col_name="ID")
-        self._drop_unnecessary_columns()
-        self._rename_columns()
-        self._remove_wrong_levels()
-        self._remove_wrong_causes()
-        self._remove_wrong_plant_ids()
-        self._col_to_datetime(col_name=["start_curtailment",
-                                        "end_curtailment"])
-        self._sort_by_column(col_name="start_curtailment")
-        self._validate_duration()
+        self.timings = {}
+        mask: pd.Series = self._timed("build_mask", self._valid_rows_mask)
+        self.df = self._timed("select_columns", self._select_columns, mask)
+        self._timed("col_to_datetime", self._col_to_datetime,
+                    col_name=["start_curtailment", "end_curtailment"])
+        self._timed("sort_by_column", self._sort_by_column,
+                    col_name="start_curtailment")
+        self._timed("validate_duration", self._validate_duration)
+        logging.info("Data processing steps took %s", self.timings)
         print(f"Data processing took {time.time() - start}s")
 
+    def clean_batches(self,
+                      batches):
+        """
+        Clean data frame batches one at a time, e.g. from
+        AvaconAPI.iter_batches, so memory is bounded by the batch size.
+        Duplicate IDs are removed across batches. Each batch is sorted,
+        the batches are not sorted against each other.
+
+        :param batches: iterable, pandas dataframes
+        :return: generator, cleaned pandas dataframes
+        """
+        for batch in batches:
+            if "ID" in batch.columns:
+                batch = batch[~batch["ID"].isin(self.seen_ids)]
+                self.seen_ids.update(batch["ID"])
+            self.df = batch
+            self.clean()
+            if not self.df.empty:
+                yield self.df
+
     def get_data(self) -> pd.DataFrame:
         """
         Getter fucntion return pandas dataframe class object
@@ -42,53 +83,56 @@ class ProcessData:
         """
         return self.df
 
-    def _remove_duplicates(self,
-                           col_name: str):
-        if col_name in self.df.columns:
-            self.df.drop_duplicates(subset=col_name, inplace=True)
-        else:
-            logging.error("Column %s not in dataframe", col_name)
-            raise KeyError(f"Column {col_name} not in dataframe")
+    def _timed(self,
+               step: str,
+               function,
+               *args,
+               **kwargs):
+        """
+        Run a cleaning step and store its duration in seconds.
 
-    def _drop_unnecessary_columns(self):
-        self.df.drop(["ID", "Einsatz-ID", "Gebiet",
-                      "Ort Engpass", "Anforderer", "Anlagen-ID",
-                      "Abrechnungs-ID", "Entschädigungspflicht"],
-                      errors="ignore",
-                      axis=1,
-                      inplace=True)
-
-    def _rename_columns(self):
-        self.df.rename(columns={"Start": "start_curtailment",
-                                "Ende": "end_curtailment",
-                                "Dauer (Min)": "duration",
-                                "Stufe (%)": "level",
-                                "Ursache": "cause",
-                                "Anlagenschlüssel": "plant_id",
-                                "Netzbetreiber": "operator"},
-                        errors="raise",
-                        inplace=True)
-
-    def _remove_wrong_levels(self):
-        if "level" in self.df.columns:
-            self.df = self.df[self.df["level"].isin([0, 30, 60])]
-        else:
-            logging.error("Column level not in dataframe")
-            raise KeyError("Column level not in dataframe")
+        :param step: str, name of step in timings
+        :param function: callable, cleaning step
+        :return: any, return value of the cleaning step
+        """
+        start: float = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.timings[step] = time.perf_counter() - start
+        return result
 
-    def _remove_wrong_causes(self):
-        if "cause" in self.df.columns:
-            self.df = self.df[self.df["cause"] != "Test"]
-        else:
-            logging.error("Column cause not in dataframe")
-            raise KeyError("Column cause not in dataframe")
+    def _check_columns(self,
+                       col_name: list):
+        for c in col_name:
+            if c not in self.df.columns:
+                logging.error("Column %s not in dataframe", c)
+                raise KeyError(f"Column {c} not in dataframe")
 
-    def _remove_wrong_plant_ids(self):
-        if "plant_id" in self.df.columns:
-            self.df = self.df[self.df["plant_id"] != "Siehe Veröffentl. Netzbetreiber!"]
-        else:
-            logging.error("Column plant_id not in dataframe")
-            raise KeyError("Column plant_id not in dataframe")
+    def _valid_rows_mask(self) -> pd.Series:
+        """
+        Combine all row filters into one boolean mask: first occurrence
+        of each ID, valid levels, no test causes, and published plant IDs.
+
+        :return: pandas series, True for rows to keep
+        """
+        self._check_columns(["ID"] + list(COLUMNS.keys()))
+        return ~self.df.duplicated(subset="ID") & \
+            self.df["Stufe (%)"].isin(VALID_LEVELS) & \
+            ~self.df["Ursache"].isin(INVALID_CAUSES) & \
+            ~self.df["Anlagenschlüssel"].isin(INVALID_PLANT_IDS)
+
+    def _select_columns(self,
+                        mask: pd.Series) -> pd.DataFrame:
+        """
+        Select valid rows and necessary columns, rename the columns, and
+        cast them to the compact dtypes of the curtailment schema. The
+        raw duration is not cast, as it is recomputed from start and end.
+
+        :param mask: pandas series, True for rows to keep
+        :return: pandas dataframe, selected data
+        """
+        dtypes: dict = {c: t for c, t in CURTAILMENT_DTYPES.items() if c != "duration"}
+        return apply_schema(self.df.loc[mask, list(COLUMNS.keys())].rename(columns=COLUMNS),
+                            dtypes)
 
     def _col_to_datetime(self,
                          col_name: Union[str, list],
@@ -113,5 +157,8 @@ class ProcessData:
             raise KeyError(f"Column {col_name} not in dataframe")
 
     def _validate_duration(self):
-        self.df["duration"] = (self.df["end_curtailment"] - self.df["start_curtailment"]).dt.total_seconds() / 60
-        self.df["duration"] = self.df["duration"].round(0).astype(int)
+        duration: pd.Series = (self.df["end_curtailment"] -
+                               self.df["start_curtailment"]).dt.total_seconds() / 60
+        duration = duration.round(0).rename("duration")
+        check_int_range(duration, CURTAILMENT_DTYPES["duration"])
+        self.df["duration"] = duration.astype(CURTAILMENT_DTYPES["duration"])
@@ -2,11 +2,27 @@
 # stdlib
 import os
 import json
+import codecs
 import logging
 
 # third party
 import pandas as pd
 
+# For more Python build-in encodings check:
+# https://docs.python.org/2/library/codecs.html#standard-encodings
+ENCODINGS: list = ["utf-8", "utf-16", "utf-32",
+                   "latin1", "ascii",
+                   "iso-8859-1", "iso8859_2", "iso8859_15",
+                   "cp037", "cp437", "cp500",
+                   "cp850", "cp852", "cp858",
+                   "mac_latin2", "mac_roman"]
+# Byte order marks, UTF-32 first because BOM_UTF32_LE starts with BOM_UTF16_LE
+BOMS: list = [(codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"),
+              (codecs.BOM_UTF8, "utf-8-sig"),
+              (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")]
+# Detected encoding per (full path, modification time, size)
+ENCODING_CACHE: dict = {}
+
 
 def file_exists(full_path: str) -> bool:
     """
@@ -19,16 +35,53 @@ def file_exists(full_path: str) -> bool:
     return os.path.isfile(full_path)
 
 
+def detect_encoding(full_path: str,
+                    sample_size: int=65536) -> str:
+    """
+    Detect the encoding of a file from a bounded prefix. A byte order
+    mark decides directly, otherwise the prefix is decoded strictly with
+    each encoding of ENCODINGS until one succeeds. UTF-16 and UTF-32
+    are only detected by their byte order mark. The result is cached
+    per path, modification time, and size of the file.
+
+    :param full_path: string, full path of file
+    :param sample_size: int, number of bytes to probe
+    :return: string, name of encoding
+    """
+    stat: os.stat_result = os.stat(full_path)
+    key: tuple = (full_path, stat.st_mtime_ns, stat.st_size)
+    if key in ENCODING_CACHE:
+        return ENCODING_CACHE[key]
+
+    with open(full_path, "rb") as f:
+        sample: bytes = f.read(sample_size)
+    encoding: str = next((e for bom, e in BOMS if sample.startswith(bom)), None)
+    if encoding is None:
+        for candidate in [e for e in ENCODINGS if e not in ["utf-16", "utf-32"]]:
+            try:
+                # Not final if the prefix may cut a multi-byte character
+                codecs.getincrementaldecoder(candidate)(errors="strict").decode(
+                    sample, final=len(sample) < sample_size)
+                encoding = candidate
+                break
+            except (UnicodeDecodeError, LookupError):
+                continue
+    ENCODING_CACHE[key] = encoding
+    return encoding
+
+
 def csv_to_pd(path: str,
               file_name: str,
               separator: str=",",
               decimal: str=".",
-              low_memory: bool=True) -> pd.DataFrame:
+              low_memory: bool=True,
+              memory_map: bool=False) -> pd.DataFrame:
     """
     Read in a .csv file. Save the data in a pandas data frame if
     the file exists and a matching encoding is found.
-    For more Python build-in encodings check:
-    https://docs.python.org/2/library/codecs.html#standard-encodings
+    The encoding is detected from a prefix of the file (see
+    detect_encoding), so the file is parsed once. Only if decoding fails
+    after the prefix, the remaining encodings of ENCODINGS are tried.
 
     :param path: string, path of folder where .csv file is saved
     :param file_name: string, | name of .csv file. Has to have
@@ -38,26 +91,27 @@ def csv_to_pd(path: str,
     :param separator: string, column separator
     :param decimal: string, decimal separator
     :param low_memory: bool, to ensure no mixed types either set False
+    :param memory_map: bool, map the file into memory while parsing
     :return: pandas data frame, data from .csv file
     """
-    encodings: list = ["utf-8", "utf-16", "utf-32",
-                       "latin1", "ascii",
-                       "iso-8859-1", "iso8859_2", "iso8859_15",
-                       "cp037", "cp437", "cp500",
-                       "cp850", "cp852", "cp858",
-                       "mac_latin2", "mac_roman"]
-
     full_path: str = os.path.join(path, file_name)
 
     if file_exists(full_path):
+        detected: str = detect_encoding(full_path)
+        encodings: list = [detected] if detected is not None else []
+        encodings += [e for e in ENCODINGS if e not in encodings]
         for encoding in encodings:
             try:
                 data: pd.DataFrame = pd.read_csv(full_path,
                                                  sep=separator,
                                                  decimal=decimal,
                                                  encoding=encoding,
-                                                 low_memory=low_memory
+                                                 low_memory=low_memory,
+                                                 memory_map=memory_map
                                                  )
+                if encoding != detected:
+                    stat: os.stat_result = os.stat(full_path)
+                    ENCODING_CACHE[(full_path, stat.st_mtime_ns, stat.st_size)] = encoding
                 return data
 
             except (UnicodeDecodeError, LookupError):
@@ -67,6 +121,61 @@ def csv_to_pd(path: str,
     raise OSError(f"{full_path} not found")
 
 
+def parquet_to_pd(path: str,
+                  file_name: str,
+                  columns: list=None,
+                  filters: list=None,
+                  memory_map: bool=False) -> pd.DataFrame:
+    """
+    Read in a .parquet file or a partitioned Parquet dataset written by
+    write_file.pd_to_partitioned_parquet. Only the given columns are read
+    and partitions and row groups not matching the filters are skipped.
+
+    :param path: string, path of folder where .parquet file is saved
+    :param file_name: string, | name of .parquet file or folder of a
+                              | partitioned dataset
+    :param columns: list, columns to read, all columns if None
+    :param filters: list, | predicates as tuples (column, op, value),
+                          | e.g. [("month", ">=", "2022-03")]
+    :param memory_map: bool, map the file into memory while reading
+    :return: pandas data frame, data from .parquet file
+    """
+    full_path: str = os.path.join(path, file_name)
+
+    if file_exists(full_path) or os.path.isdir(full_path):
+        return pd.read_parquet(full_path,
+                               columns=columns,
+                               filters=filters,
+                               memory_map=memory_map)
+
+    logging.warning("%s not found", full_path)
+    raise OSError(f"{full_path} not found")
+
+
+def feather_to_pd(path: str,
+                  file_name: str,
+                  columns: list=None,
+                  memory_map: bool=False) -> pd.DataFrame:
+    """
+    Read in a .feather file.
+
+    :param path: string, path of folder where .feather file is saved
+    :param file_name: string, name of .feather file
+    :param columns: list, columns to read, all columns if None
+    :param memory_map: bool, map the file into memory while reading
+    :return: pandas data frame, data from .feather file
+    """
+    full_path: str = os.path.join(path, file_name)
+
+    if file_exists(full_path):
+        return pd.read_feather(full_path,
+                               columns=columns,
+                               memory_map=memory_map)
+
+    logging.warning("%s not found", full_path)
+    raise OSError(f"{full_path} not found")
+
+
 def json_to_dict(path: str,
                  file_name: str) -> dict:
     """
@@ -0,0 +1,99 @@
+"""Module declaring the column types of curtailment data"""
+# stdlib
+import logging
+
+# third party
+import numpy as np
+import pandas as pd
+
+# Compact pandas dtypes of curtailment data frames. level only takes the
+# values 0, 30, and 60, durations are given in minutes, and power and
+# energy are given in kW and kWh with less than 7 significant digits.
+CURTAILMENT_DTYPES: dict = {"duration": "int16",
+                            "level": "int8",
+                            "cause": "category",
+                            "plant_id": "category",
+                            "operator": "category",
+                            "power_nominal": "float32",
+                            "power_curtailed": "float32",
+                            "energy_curtailed": "float32"}
+
+# Compact pandas dtypes of the raw columns of the Avacon API
+AVACON_DTYPES: dict = {"Ursache": "category",
+                       "Netzbetreiber": "category",
+                       "Anlagenschlüssel": "category"}
+
+# Matching PostgreSQL table of curtailment data frames with the natural
+# key of PostgreSQL.upsert, formatted with psycopg2.sql identifiers for
+# table and key
+CREATE_CURTAILMENTS: str = """CREATE TABLE IF NOT EXISTS {table} (
+start_curtailment TIMESTAMP, end_curtailment TIMESTAMP,
+duration SMALLINT, level SMALLINT,
+cause VARCHAR, plant_id VARCHAR, operator VARCHAR,
+power_nominal REAL, power_curtailed REAL, energy_curtailed REAL,
+CONSTRAINT {key} UNIQUE (start_curtailment, plant_id));"""
+
+# Variant of CREATE_CURTAILMENTS partitioned by range of start_curtailment,
+# formatted with psycopg2.sql identifiers for table and key. The natural
+# key of PostgreSQL.upsert contains the partition key, as required for
+# unique constraints of partitioned tables.
+CREATE_PARTITIONED_CURTAILMENTS: str = """CREATE TABLE IF NOT EXISTS {table} (
+start_curtailment TIMESTAMP NOT NULL, end_curtailment TIMESTAMP,
+duration SMALLINT, level SMALLINT,
+cause VARCHAR, plant_id VARCHAR, operator VARCHAR,
+power_nominal REAL, power_curtailed REAL, energy_curtailed REAL,
+CONSTRAINT {key} UNIQUE (start_curtailment, plant_id))
+PARTITION BY RANGE (start_curtailment);"""
+
+# Time buckets of the rollup tables and their pandas period aliases. Each
+# rollup is refreshed from the next finer one, the first from the raw rows.
+ROLLUP_GRAINS: dict = {"hour": "h",
+                       "day": "D",
+                       "month": "M"}
+
+# Rollup table of curtailments per time bucket, plant, operator, and
+# cause, formatted with a psycopg2.sql identifier for the table
+CREATE_ROLLUP: str = """CREATE TABLE IF NOT EXISTS {table} (
+bucket TIMESTAMP NOT NULL, plant_id VARCHAR, operator VARCHAR, cause VARCHAR,
+curtailments INTEGER, duration BIGINT,
+energy_curtailed DOUBLE PRECISION, power_curtailed_max REAL);"""
+
+
+def apply_schema(df: pd.DataFrame,
+                 dtypes: dict=None) -> pd.DataFrame:
+    """
+    Cast all columns of a data frame, which are declared in the schema,
+    to their compact dtype. Other columns are left untouched.
+
+    :param df: pandas data frame, data to cast
+    :param dtypes: dict, | column names and dtypes, defaults to
+                         | CURTAILMENT_DTYPES
+    :return: pandas data frame, data with compact dtypes
+    """
+    dtypes: dict = CURTAILMENT_DTYPES if dtypes is None else dtypes
+    casts: dict = {c: t for c, t in dtypes.items()
+                   if c in df.columns and df[c].dtype != t}
+    if not casts:
+        return df
+    for c, t in casts.items():
+        if t != "category" and np.issubdtype(np.dtype(t), np.integer):
+            check_int_range(df[c], t)
+    return df.astype(casts)
+
+
+def check_int_range(series: pd.Series,
+                    dtype: str) -> None:
+    """
+    Raise if a column holds values outside of the range of an integer
+    dtype, as astype would silently wrap them around.
+
+    :param series: pandas series, values to cast
+    :param dtype: str, integer dtype, e.g. "int16"
+    """
+    info: np.iinfo = np.iinfo(dtype)
+    if series.empty or (series.min() >= info.min and series.max() <= info.max):
+        return
+    logging.error("Column %s exceeds range of %s: %s to %s",
+                  series.name, dtype, series.min(), series.max())
+    raise ValueError(f"Column {series.name} exceeds range of {dtype}: "
+                     f"{series.min()} to {series.max()}")
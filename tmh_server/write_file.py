@@ -3,6 +3,9 @@ Module providing functions to write data to a file.
 """
 # stdlib
 import os
+import json
+import logging
+from urllib.parse import quote
 
 # third party
 import pandas as pd
@@ -49,8 +52,162 @@ def pd_to_csv(data: pd.DataFrame,
               "\tThe file already exists and overwriting is "
               "disabled.")
     else:
-        data.to_csv(full_path,
-                    sep=separator,
-                    index=index,
-                    encoding=encoding
-                    )
+        _atomic_write(full_path,
+                      lambda tmp_path: data.to_csv(tmp_path,
+                                                   sep=separator,
+                                                   index=index,
+                                                   encoding=encoding
+                                                   ))
+
+
+def pd_to_parquet(data: pd.DataFrame,
+                  path: str,
+                  file_name: str,
+                  compression: str="snappy",
+                  row_group_size: int=None,
+                  overwrite=False) -> None:
+    """
+    Writes a pandas data frame to a .parquet file.
+
+    :param data: pandas data frame, data which is written to a .parquet file
+    :param path: string, path of folder where .parquet file is written to
+    :param file_name: string, name of .parquet file
+    :param compression: string, | compression codec, e.g. "snappy",
+                                | "zstd", "gzip", or None
+    :param row_group_size: int, | maximum number of rows per row group,
+                                | smaller groups allow finer predicate
+                                | pushdown when reading
+    :param overwrite: boolean, | True if an already existing file can
+                               | be overwritten
+    """
+    full_path: str = os.path.join(path, file_name)
+
+    if not overwrite and file_exists(full_path):
+        print("No file written for " + full_path +
+              "\tThe file already exists and overwriting is "
+              "disabled.")
+    else:
+        _atomic_write(full_path,
+                      lambda tmp_path: data.to_parquet(tmp_path,
+                                                       index=False,
+                                                       compression=compression,
+                                                       row_group_size=row_group_size
+                                                       ))
+
+
+def pd_to_feather(data: pd.DataFrame,
+                  path: str,
+                  file_name: str,
+                  compression: str="zstd",
+                  overwrite=False) -> None:
+    """
+    Writes a pandas data frame to a .feather file.
+
+    :param data: pandas data frame, data which is written to a .feather file
+    :param path: string, path of folder where .feather file is written to
+    :param file_name: string, name of .feather file
+    :param compression: string, compression codec, "zstd", "lz4", or "uncompressed"
+    :param overwrite: boolean, | True if an already existing file can
+                               | be overwritten
+    """
+    full_path: str = os.path.join(path, file_name)
+
+    if not overwrite and file_exists(full_path):
+        print("No file written for " + full_path +
+              "\tThe file already exists and overwriting is "
+              "disabled.")
+    else:
+        _atomic_write(full_path,
+                      lambda tmp_path: data.reset_index(drop=True).to_feather(
+                          tmp_path, compression=compression))
+
+
+def pd_to_partitioned_parquet(data: pd.DataFrame,
+                              path: str,
+                              time_column: str="start_curtailment",
+                              partition_cols: list=None,
+                              compression: str="snappy",
+                              row_group_size: int=None) -> list:
+    """
+    Writes a pandas data frame to a Hive-style partitioned Parquet
+    dataset, e.g. path/month=2022-01/operator=Avacon/data.parquet.
+    Existing partitions contained in the data frame are replaced, other
+    partitions are kept. Partition columns are stored in the directory
+    names only and restored by read_file.parquet_to_pd. Rows with a
+    missing partition value are rejected, as they can not be stored in
+    a partition readable by pyarrow.
+
+    :param data: pandas data frame, data which is written to the dataset
+    :param path: string, path of folder of the dataset
+    :param time_column: string, | datetime column to partition by month,
+                                | no month partition if None
+    :param partition_cols: list, | further columns to partition by,
+                                 | defaults to ["operator"]
+    :param compression: string, compression codec of the .parquet files
+    :param row_group_size: int, maximum number of rows per row group
+    :return: list, written .parquet files
+    """
+    partition_cols: list = ["operator"] if partition_cols is None else partition_cols
+    keys: list = list(partition_cols)
+    if time_column is not None:
+        data = data.assign(month=data[time_column].dt.strftime("%Y-%m"))
+        keys = ["month"] + keys
+
+    missing: int = int(data[keys].isna().any(axis=1).sum())
+    if missing:
+        logging.error("%s rows miss a value of %s", missing, keys)
+        raise ValueError(f"{missing} rows miss a value of {keys}")
+
+    written: list = []
+    for values, df in data.groupby(keys, observed=True, sort=False, dropna=False):
+        values: tuple = values if isinstance(values, tuple) else (values,)
+        folder: str = os.path.join(path, *[f"{k}={quote(str(v), safe='')}"
+                                           for k, v in zip(keys, values)])
+        os.makedirs(folder, exist_ok=True)
+        pd_to_parquet(df.drop(columns=keys),
+                      path=folder,
+                      file_name="data.parquet",
+                      compression=compression,
+                      row_group_size=row_group_size,
+                      overwrite=True)
+        written.append(os.path.join(folder, "data.parquet"))
+    return written
+
+
+def dict_to_json(data: dict,
+                 path: str,
+                 file_name: str) -> None:
+    """
+    Writes a dictionary to a .json file. An existing file is replaced
+    atomically, e.g. to keep checkpoints consistent after crashes.
+
+    :param data: dict, data which is written to a .json file
+    :param path: string, path of folder where .json file is written to
+    :param file_name: string, name of .json file
+    """
+    def write(tmp_path: str):
+        with open(tmp_path, "w", encoding="utf-8") as json_file:
+            json.dump(data, json_file)
+
+    _atomic_write(os.path.join(path, file_name), write)
+
+
+def _atomic_write(full_path: str,
+                  write) -> None:
+    """
+    Write to a temporary file next to the target and rename it
+    afterwards, so readers never see partial files. The temporary file
+    is hidden and ends with the name of the target, so e.g. pandas still
+    infers the compression from the extension.
+
+    :param full_path: string, path of target file
+    :param write: callable, writes to the path it is called with
+    """
+    directory, file_name = os.path.split(full_path)
+    tmp_path: str = os.path.join(directory, f".{os.getpid()}.tmp.{file_name}")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, full_path)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)